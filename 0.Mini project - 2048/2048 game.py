@@ -4,6 +4,7 @@ Clone of 2048 game.
 
 import poc_2048_gui
 import random
+import time
 
 # Directions, DO NOT MODIFY
 UP = 1
@@ -16,8 +17,33 @@ RIGHT = 4
 OFFSETS = {UP: (1, 0), 
            DOWN: (-1, 0), 
            LEFT: (0, 1), 
-           RIGHT: (0, -1)} 
-   
+           RIGHT: (0, -1)}
+
+# Bitboard engine constants: a 4x4 board packed in a 64-bit integer,
+# 4 bits per tile holding the base 2 exponent of the tile value
+# (0 for an empty square). Row r uses bits 16*r to 16*r+15 and
+# column c of that row the 4 bits starting at 16*r+4*c.
+BITBOARD_SIZE = 4
+ROW_MASK = 0xFFFF
+MAX_EXPONENT = 15
+TILE_VALUES = [0] + [2 ** exp for exp in range(1, MAX_EXPONENT + 1)]
+EXPONENTS = dict([(TILE_VALUES[exp], exp) for exp in range(MAX_EXPONENT + 1)])
+
+# Binary format of a saved game: a version byte, the height and the
+# width as varints, a flags byte, the tile exponents in row-major
+# order (two per byte unless SERIAL_WIDE is set), then the optional
+# score and random number generator state. Version 1 held the height
+# and the width in single bytes and can still be read. The generator state is followed by
+# the order of the empty squares new_tile draws from, so a restored
+# game adds the same tiles as the saved one would have.
+SERIAL_VERSION = 2
+SERIAL_SCORE = 1
+SERIAL_RNG = 2
+SERIAL_WIDE = 4
+
+# Number of distinct lines kept by the merge cache
+MERGE_CACHE_SIZE = 100000
+
 def slide(line):
     """Slide the values in the line list to the left/forward
     such that no 0 appears in between non-zero values
@@ -45,40 +71,348 @@ def merged(line):
 
 def merge(line):
     """
-    Helper function that merges a single row or column in 2048
+    Helper function that merges a single row or column in 2048.
+    Results come from MERGE_CACHE, which runs merge_line on lines
+    it has not seen recently.
     """
-    slided= slide(line)
-    all_merged = merged(slided)
-    result= slide(all_merged)
-    return result
+    return list(MERGE_CACHE.merge_line(line)[0])
+
+def merge_line(line):
+    """
+    Merge a single row or column in one pass and return the
+    merged line, the score of the merges and the list of the
+    indices in the merged line holding merged tiles
+    """
+    result = []
+    score = 0
+    merges = []
+    pending = 0
+    for value in line:
+        if value == 0:
+            continue
+        if value == pending:
+            merges.append(len(result))
+            result.append(value + pending)
+            score += value + pending
+            pending = 0
+        else:
+            if pending != 0:
+                result.append(pending)
+            pending = value
+    if pending != 0:
+        result.append(pending)
+    result.extend([0] * (len(line) - len(result)))
+    return result, score, merges
+
+class LineCache:
+    """
+    Bounded cache of merge_line results keyed on the line tuple,
+    dropping the least recently used line when full. Entries sit
+    in a circular doubly linked list of [previous, next, key,
+    value] links, most recently used just before the root link.
+    """
+
+    def __init__(self, capacity):
+        self._capacity = capacity
+        self._entries = {}
+        self._root = [None, None, None, None]
+        self._root[0] = self._root
+        self._root[1] = self._root
+        self._hits = 0
+        self._misses = 0
+
+    def merge_line(self, line):
+        """
+        Return the merged line, the score of the merges and the
+        indices of the merged tiles, all as tuples that must not
+        be changed
+        """
+        key = tuple(line)
+        root = self._root
+        link = self._entries.get(key)
+        if link is not None:
+            self._hits += 1
+            link[0][1] = link[1]
+            link[1][0] = link[0]
+        else:
+            self._misses += 1
+            result, score, merges = merge_line(key)
+            if len(self._entries) >= self._capacity:
+                oldest = root[1]
+                root[1] = oldest[1]
+                oldest[1][0] = root
+                del self._entries[oldest[2]]
+            link = [None, None, key, (tuple(result), score, tuple(merges))]
+            self._entries[key] = link
+        last = root[0]
+        last[1] = link
+        link[0] = last
+        link[1] = root
+        root[0] = link
+        return link[3]
+
+    def get_hits(self):
+        """
+        Return the number of lookups answered from the cache.
+        """
+        return self._hits
+
+    def get_misses(self):
+        """
+        Return the number of lookups that had to merge the line.
+        """
+        return self._misses
+
+    def get_size(self):
+        """
+        Return the number of lines in the cache.
+        """
+        return len(self._entries)
+
+    def clear(self):
+        """
+        Empty the cache and reset the counters.
+        """
+        self._entries = {}
+        self._root[0] = self._root
+        self._root[1] = self._root
+        self._hits = 0
+        self._misses = 0
+
+MERGE_CACHE = LineCache(MERGE_CACHE_SIZE)
+
+def merge_exponents(line):
+    """
+    Merge a single row or column of tile exponents in one pass
+    and return the merged line and the score of the merges
+    """
+    result = []
+    score = 0
+    pending = 0
+    for exponent in line:
+        if exponent == 0:
+            continue
+        if exponent == pending:
+            result.append(exponent + 1)
+            score += 2 ** (exponent + 1)
+            pending = 0
+        else:
+            if pending != 0:
+                result.append(pending)
+            pending = exponent
+    if pending != 0:
+        result.append(pending)
+    result.extend([0] * (len(line) - len(result)))
+    return result, score
+
+def get_line_cells(grid_height, grid_width, direction):
+    """
+    Return the list of lines to merge when moving in the given
+    direction, each line a list of (row, col) cells starting at
+    the edge the tiles move towards
+    """
+    if direction == UP:
+        starts = [(0, col) for col in range(grid_width)]
+        steps = grid_height
+    elif direction == DOWN:
+        starts = [(grid_height - 1, col) for col in range(grid_width)]
+        steps = grid_height
+    elif direction == LEFT:
+        starts = [(row, 0) for row in range(grid_height)]
+        steps = grid_width
+    else:
+        starts = [(row, grid_width - 1) for row in range(grid_height)]
+        steps = grid_width
+    offset = OFFSETS[direction]
+    return [[(row + step * offset[0], col + step * offset[1])
+             for step in range(steps)] for row, col in starts]
+
+# Lines of every direction as row-major indices, per board size
+LINE_INDICES = {}
+
+def get_line_indices(grid_height, grid_width):
+    """
+    Return a dictionary mapping each direction to its lines as
+    lists of row-major indices into a flat grid. The tables are
+    built once per board size and shared by every caller.
+    """
+    key = (grid_height, grid_width)
+    if key not in LINE_INDICES:
+        LINE_INDICES[key] = dict([
+            (direction, [tuple([row * grid_width + col for row, col in cells])
+                         for cells in get_line_cells(grid_height, grid_width,
+                                                     direction)])
+            for direction in (UP, DOWN, LEFT, RIGHT)])
+    return LINE_INDICES[key]
+
+def move_boards(boards, direction):
+    """
+    Move every grid in the list boards (all of the same size) in
+    the given direction without adding new tiles. Return the list
+    of moved grids, the list telling whether each grid changed and
+    the list of scores gained by the merges. Lines are merged once
+    per distinct line across the whole batch. Batches of packed 4x4
+    boards move faster through move_packed_boards.
+    """
+    if not boards:
+        return [], [], []
+    grid_height = len(boards[0])
+    grid_width = len(boards[0][0])
+    lines = get_line_indices(grid_height, grid_width)[direction]
+    merged_lines = {}
+    moved_boards = []
+    changed = []
+    scores = []
+    for board in boards:
+        cells = []
+        for row in board:
+            cells.extend(row)
+        moved = list(cells)
+        score = 0
+        for indices in lines:
+            line = tuple([cells[index] for index in indices])
+            if line not in merged_lines:
+                merged_lines[line] = merge_line(line)
+            result, line_score, dummy_merges = merged_lines[line]
+            score += line_score
+            for idx in range(len(indices)):
+                moved[indices[idx]] = result[idx]
+        moved_boards.append([moved[row * grid_width:(row + 1) * grid_width]
+                             for row in range(grid_height)])
+        changed.append(moved != cells)
+        scores.append(score)
+    return moved_boards, changed, scores
+
+def tile_exponent(value):
+    """
+    Return the base 2 exponent of a tile value, 0 for no tile
+    """
+    if value in EXPONENTS:
+        return EXPONENTS[value]
+    exponent = 0
+    while value > 1:
+        value >>= 1
+        exponent += 1
+    return exponent
+
+def write_varint(data, value):
+    """
+    Append a non-negative integer to the bytearray data, 7 bits
+    per byte with the high bit set on all bytes but the last
+    """
+    while value >= 0x80:
+        data.append((value & 0x7F) | 0x80)
+        value >>= 7
+    data.append(value)
+
+def read_varint(data, position):
+    """
+    Return the integer written by write_varint at the given
+    position of data and the position following it
+    """
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            return value, position
+
+def write_rng_state(data, state):
+    """
+    Append the state returned by getstate of a random number
+    generator to the bytearray data
+    """
+    version, internal, gauss_next = state
+    write_varint(data, version)
+    write_varint(data, len(internal))
+    for word in internal:
+        data.extend([(word >> 24) & 0xFF, (word >> 16) & 0xFF,
+                     (word >> 8) & 0xFF, word & 0xFF])
+    if gauss_next is None:
+        data.append(0)
+    else:
+        text = repr(gauss_next)
+        data.append(1)
+        write_varint(data, len(text))
+        data.extend([ord(char) for char in text])
+
+def read_rng_state(data, position):
+    """
+    Return the random number generator state written by
+    write_rng_state at the given position of data and the
+    position following it
+    """
+    version, position = read_varint(data, position)
+    length, position = read_varint(data, position)
+    internal = []
+    for dummy in range(length):
+        internal.append((data[position] << 24) | (data[position + 1] << 16)
+                        | (data[position + 2] << 8) | data[position + 3])
+        position += 4
+    gauss_next = None
+    position += 1
+    if data[position - 1]:
+        length, position = read_varint(data, position)
+        text = "".join([chr(byte) for byte in data[position:position + length]])
+        gauss_next = float(text)
+        position += length
+    return (version, tuple(internal), gauss_next), position
+
+class MoveResult:
+    """
+    Outcome of a move: whether any tile moved, the score gained
+    by the merges, the list of (row, col) squares holding the
+    merged tiles and the (row, col, value) of the tile added
+    afterwards, if any
+    """
+
+    def __init__(self, moved, score, merged_cells, spawned=None):
+        self.moved = moved
+        self.score = score
+        self.merged_cells = merged_cells
+        self.spawned = spawned
+
+    def __str__(self):
+        """
+        Return a string representation of the result for debugging.
+        """
+        return str((self.moved, self.score, self.merged_cells))
 
 class TwentyFortyEight:
     """
-    Class to run the game logic.
+    Class to run the game logic. The grid is kept in one flat list
+    in row-major order, the tile at row, col at index
+    row * width + col.
     """
 
-    def __init__(self, grid_height, grid_width):
+    def __init__(self, grid_height, grid_width, rng=random):
         self._height = grid_height
         self._width = grid_width
+        # random number generator used by new_tile, anything with
+        # the randrange and choice functions of the random module
+        self._rng = rng
+        #stuff for the move method: the flat indices of every line
+        #in every direction, shared by all games of this size
+        self._move_dict = get_line_indices(grid_height, grid_width)
         self.reset()
-        #stuff for the move method
-        up_list = [(0, col) for col in range(self._width)]
-        down_list = [(self._height-1, col) for col in range(self._width)]
-        left_list = [(row, 0) for row in range(self._height)]
-        right_list = [(row, self._width-1) for row in range(self._height)]
-        self._move_dict = {UP:up_list, DOWN:down_list, LEFT:left_list, RIGHT:right_list}
     
     def reset(self):
         """
         Reset the game so the grid is empty.
         """
-        self._grid = [[0 for dummy2 in range(self._width)] for dummy1 in range(self._height)]
+        self._cells = [0] * (self._height * self._width)
+        self._score = 0
+        self._index_tiles()
     
     def __str__(self):
         """
         Return a string representation of the grid for debugging.
         """
-        return str(self._grid)
+        return str([self._cells[row * self._width:(row + 1) * self._width]
+                    for row in range(self._height)])
 
     def get_grid_height(self):
         """
@@ -91,73 +425,1484 @@ class TwentyFortyEight:
         Get the width of the board.
         """
         return self._width
+
+    def get_score(self):
+        """
+        Get the total score of the merges since the last reset.
+        """
+        return self._score
+
+    def get_max_tile(self):
+        """
+        Get the value of the highest tile on the board.
+        """
+        return self._max_tile
                             
-    def move(self, direction):
+    def move(self, direction, add_tile=True):
         """
         Move all tiles in the given direction and add
-        a new tile if any tiles moved.
+        a new tile if any tiles moved, unless add_tile is False.
+        Return the MoveResult; lines that do not change are not
+        written back.
         """
-        direction_tiles = self._move_dict[direction]
-        #print direction_tiles
-        offset = list(OFFSETS[direction])
-        
-        times = 0
-        if (direction == 1 or direction == 2):
-            times = self._height
-        elif (direction == 3 or direction == 4):
-            times = self._width
-        
-        for current_tile in direction_tiles:
-            tile = list(current_tile)
-            temp_list = []
-            temp_list.append(self.get_tile(tile[0], tile[1]))
-            for dummy in range(times-1):
-                tile[0] += offset[0]
-                tile[1] += offset[1]
-                temp_list.append(self.get_tile(tile[0], tile[1]))
-            result = merge(temp_list)
-            tile = list(current_tile)
-            self.set_tile(tile[0], tile[1], result[0])
-            for idx in range(1, times):
-                tile[0] += offset[0]
-                tile[1] += offset[1]
-                self.set_tile(tile[0], tile[1], result[idx])
-  
-        self.new_tile()
+        cells = self._cells
+        moved = False
+        score = 0
+        merged_cells = []
+        for indices in self._move_dict[direction]:
+            line = tuple([cells[index] for index in indices])
+            result, line_score, merges = MERGE_CACHE.merge_line(line)
+            if result == line:
+                continue
+            moved = True
+            score += line_score
+            for idx in merges:
+                merged_cells.append(divmod(indices[idx], self._width))
+            for idx in range(len(indices)):
+                if result[idx] != line[idx]:
+                    self._track_tile(indices[idx], line[idx], result[idx])
+                    cells[indices[idx]] = result[idx]
+        self._score += score
+        spawned = None
+        if moved and add_tile:
+            spawned = self.new_tile()
+        return MoveResult(moved, score, merged_cells, spawned)
+
+    def legal_moves(self):
+        """
+        Return the list of directions in which a move would change
+        the grid, found with a single scan of the adjacent pairs of
+        squares.
+        """
+        cells = self._cells
+        width = self._width
+        legal = {UP: False, DOWN: False, LEFT: False, RIGHT: False}
+        for row in range(self._height):
+            for col in range(width):
+                index = row * width + col
+                value = cells[index]
+                if col + 1 < width:
+                    next_value = cells[index + 1]
+                    if value != 0 and (next_value == 0 or next_value == value):
+                        legal[RIGHT] = True
+                    if next_value != 0 and (value == 0 or value == next_value):
+                        legal[LEFT] = True
+                if row + 1 < self._height:
+                    next_value = cells[index + width]
+                    if value != 0 and (next_value == 0 or next_value == value):
+                        legal[DOWN] = True
+                    if next_value != 0 and (value == 0 or value == next_value):
+                        legal[UP] = True
+        return [direction for direction in (UP, DOWN, LEFT, RIGHT)
+                if legal[direction]]
+
+    def preview(self, direction):
+        """
+        Return the grid, as a list of rows, that moving in the given
+        direction would leave before the new tile is added. The game
+        is not changed.
+        """
+        cells = list(self._cells)
+        for indices in self._move_dict[direction]:
+            line = tuple([cells[index] for index in indices])
+            result = MERGE_CACHE.merge_line(line)[0]
+            for idx in range(len(indices)):
+                cells[indices[idx]] = result[idx]
+        return [cells[row * self._width:(row + 1) * self._width]
+                for row in range(self._height)]
+
+    def preview_all(self):
+        """
+        Return a dictionary mapping each direction to the grid that
+        preview would return for it. Each row and column is read
+        once and merged towards both of its ends.
+        """
+        width = self._width
+        rows = [tuple(self._cells[row * width:(row + 1) * width])
+                for row in range(self._height)]
+        columns = list(zip(*rows))
+        grids = {}
+        for towards_start, towards_end, lines in ((LEFT, RIGHT, rows),
+                                                  (UP, DOWN, columns)):
+            start_lines = []
+            end_lines = []
+            for line in lines:
+                start_lines.append(list(MERGE_CACHE.merge_line(line)[0]))
+                result = list(MERGE_CACHE.merge_line(line[::-1])[0])
+                result.reverse()
+                end_lines.append(result)
+            grids[towards_start] = start_lines
+            grids[towards_end] = end_lines
+        for direction in (UP, DOWN):
+            grids[direction] = [list(row) for row in zip(*grids[direction])]
+        return grids
+
+    def is_game_over(self):
+        """
+        Return True if no move can change the grid: there is no
+        empty square next to a tile and no two adjacent tiles are
+        equal.
+        """
+        if self._empty:
+            # some tile borders an empty square unless all are empty
+            return len(self._empty) == self._height * self._width
+        cells = self._cells
+        width = self._width
+        for row in range(self._height):
+            for col in range(width):
+                index = row * width + col
+                if col + 1 < width and cells[index + 1] == cells[index]:
+                    return False
+                if row + 1 < self._height and cells[index + width] == cells[index]:
+                    return False
+        return True
         
     def new_tile(self):
         """
         Create a new tile in a randomly selected empty 
         square.  The tile should be 2 90% of the time and
-        4 10% of the time.
+        4 10% of the time. Return the (row, col, value) of the
+        new tile, or None if the grid is full.
         """
         #randomly select an empty square
-        selected = False
-        count = self._width * self._height
-        while (selected != True and count != 0):
-            row = random.randint(0, self._height-1)
-            col = random.randint(0, self._width-1)
-            if self.get_tile(row, col) == 0:
-                selected = True
-            if (selected == True):
-                probable_value = [2, 2, 2, 2, 2, 2, 2, 2, 2, 4]
-                tile = random.choice(probable_value)
-                self.set_tile(row, col, tile)
-            count -= 1
-        
+        if not self._empty:
+            return None
+        index = self._empty[self._rng.randrange(len(self._empty))]
+        probable_value = [2, 2, 2, 2, 2, 2, 2, 2, 2, 4]
+        row, col = divmod(index, self._width)
+        value = self._rng.choice(probable_value)
+        self.set_tile(row, col, value)
+        return row, col, value
+
+    def _index_tiles(self):
+        """
+        Rebuild the index of empty squares and the tile counts from
+        the grid. The flat indices of the empty squares are kept in
+        a list, with a dictionary mapping each of them to its
+        position in the list.
+        The tile counts map each tile value on the board to the
+        number of tiles with that value.
+        """
+        self._empty = []
+        self._empty_position = {}
+        self._tile_counts = {}
+        self._max_tile = 0
+        for row in range(self._height):
+            for col in range(self._width):
+                value = self.get_tile(row, col)
+                if value == 0:
+                    self._empty_position[row * self._width + col] = len(self._empty)
+                    self._empty.append(row * self._width + col)
+                else:
+                    self._tile_counts[value] = self._tile_counts.get(value, 0) + 1
+                    self._max_tile = max(self._max_tile, value)
+
+    def _track_tile(self, index, old_value, value):
+        """
+        Update the index of empty squares and the tile counts for
+        the tile at the given flat index changing from old_value to
+        value. A square that fills up is swapped with the last
+        empty square and popped.
+        """
+        if old_value != 0:
+            self._tile_counts[old_value] -= 1
+            if self._tile_counts[old_value] == 0:
+                del self._tile_counts[old_value]
+        if value != 0:
+            self._tile_counts[value] = self._tile_counts.get(value, 0) + 1
+        if value > self._max_tile:
+            self._max_tile = value
+        elif old_value == self._max_tile and old_value not in self._tile_counts:
+            # at most one count per tile value, so this stays small
+            self._max_tile = max([0] + list(self._tile_counts.keys()))
+
+        if old_value == 0 and value != 0:
+            position = self._empty_position.pop(index)
+            last = self._empty.pop()
+            if position < len(self._empty):
+                self._empty[position] = last
+                self._empty_position[last] = position
+        elif old_value != 0 and value == 0:
+            self._empty_position[index] = len(self._empty)
+            self._empty.append(index)
+
     def set_tile(self, row, col, value):
         """
         Set the tile at position row, col to have the given value.
         """        
-        self._grid[row][col] = value
+        index = row * self._width + col
+        self._track_tile(index, self._cells[index], value)
+        self._cells[index] = value
         
     def get_tile(self, row, col):
         """
         Return the value of the tile at position row, col.
         """ 
         #print row, col
-        return self._grid[row][col]
- 
+        return self._cells[row * self._width + col]
+
+    def snapshot(self):
+        """
+        Return an immutable copy of the grid and score that
+        restore can bring the game back to.
+        """
+        return tuple(self._cells), self._score
+
+    def restore(self, snapshot):
+        """
+        Bring the game back to a snapshot taken of a game of
+        the same size.
+        """
+        self._cells = list(snapshot[0])
+        self._score = snapshot[1]
+        self._index_tiles()
+
+    def to_bytes(self, include_score=True, include_rng=False):
+        """
+        Return the game packed in the binary format described by
+        the SERIAL_ constants, optionally with the score and the
+        state of the random number generator.
+        """
+        exponents = [tile_exponent(self.get_tile(row, col))
+                     for row in range(self._height)
+                     for col in range(self._width)]
+        flags = 0
+        if include_score:
+            flags |= SERIAL_SCORE
+        if include_rng:
+            flags |= SERIAL_RNG
+        if max(exponents) > MAX_EXPONENT:
+            flags |= SERIAL_WIDE
+        data = bytearray([SERIAL_VERSION])
+        write_varint(data, self._height)
+        write_varint(data, self._width)
+        data.append(flags)
+        if flags & SERIAL_WIDE:
+            data.extend(exponents)
+        else:
+            for idx in range(0, len(exponents) - 1, 2):
+                data.append(exponents[idx] | (exponents[idx + 1] << 4))
+            if len(exponents) % 2:
+                data.append(exponents[-1])
+        if include_score:
+            write_varint(data, self._score)
+        if include_rng:
+            write_rng_state(data, self._rng.getstate())
+            write_varint(data, len(self._empty))
+            for index in self._empty:
+                write_varint(data, index)
+        return bytes(data)
+
+    def from_bytes(cls, data, rng=None):
+        """
+        Return a new game from bytes returned by to_bytes. A saved
+        random number generator state is loaded into rng, or into a
+        new random.Random when rng is None.
+        """
+        data = bytearray(data)
+        if data[0] == 1:
+            height, width, flags = data[1], data[2], data[3]
+            position = 4
+        elif data[0] == SERIAL_VERSION:
+            height, position = read_varint(data, 1)
+            width, position = read_varint(data, position)
+            flags = data[position]
+            position += 1
+        else:
+            raise ValueError("unknown game format version " + str(data[0]))
+        if flags & SERIAL_WIDE:
+            exponents = list(data[position:position + height * width])
+            position += height * width
+        else:
+            exponents = []
+            for byte in data[position:position + (height * width + 1) // 2]:
+                exponents.append(byte & 0xF)
+                exponents.append(byte >> 4)
+            position += (height * width + 1) // 2
+        score = 0
+        if flags & SERIAL_SCORE:
+            score, position = read_varint(data, position)
+        empty = None
+        if flags & SERIAL_RNG:
+            state, position = read_rng_state(data, position)
+            if rng is None:
+                rng = random.Random()
+            rng.setstate(state)
+            length, position = read_varint(data, position)
+            empty = []
+            for dummy in range(length):
+                index, position = read_varint(data, position)
+                empty.append(index)
+        elif rng is None:
+            rng = random
+        game = cls(height, width, rng)
+        for row in range(height):
+            for col in range(width):
+                exponent = exponents[row * width + col]
+                if exponent != 0:
+                    game.set_tile(row, col, 2 ** exponent)
+        game._score = score
+        if empty is not None:
+            game._empty = empty
+            game._empty_position = dict([(empty[idx], idx)
+                                         for idx in range(len(empty))])
+        return game
+    from_bytes = classmethod(from_bytes)
+
+# Lookup tables with the result of moving every possible packed
+# row to the left and to the right, the score of the merges, the
+# tuple of the columns holding merged tiles and the tuple of the
+# (column, old value, new value) of the squares that change,
+# filled on first use
+ROW_LEFT = []
+ROW_RIGHT = []
+ROW_LEFT_SCORE = []
+ROW_RIGHT_SCORE = []
+ROW_LEFT_MERGES = []
+ROW_RIGHT_MERGES = []
+ROW_LEFT_CHANGES = []
+ROW_RIGHT_CHANGES = []
+
+def pack_row(line):
+    """
+    Pack a line of 4 tile values into a 16-bit row, the first
+    tile in the low bits. A merge of two tiles of the largest
+    representable value saturates at that value.
+    """
+    row = 0
+    for idx in range(BITBOARD_SIZE):
+        exponent = EXPONENTS.get(line[idx], MAX_EXPONENT)
+        row |= exponent << (4 * idx)
+    return row
+
+def unpack_row(row):
+    """
+    Return the list of the 4 tile values packed in a 16-bit row
+    """
+    return [TILE_VALUES[(row >> (4 * idx)) & 0xF]
+            for idx in range(BITBOARD_SIZE)]
+
+def build_row_tables():
+    """
+    Fill the row lookup tables by running merge_line on each of
+    the 65536 possible rows, so both engines agree on every move.
+    """
+    if ROW_LEFT:
+        return
+    # the few distinct (column, old value, new value) changes are
+    # shared between the rows
+    changes = {}
+    for row in range(ROW_MASK + 1):
+        line = unpack_row(row)
+        left, score, merges = merge_line(line)
+        ROW_LEFT.append(pack_row(left))
+        ROW_LEFT_SCORE.append(score)
+        ROW_LEFT_MERGES.append(tuple(merges))
+        ROW_LEFT_CHANGES.append(row_changes(line, ROW_LEFT[row], changes,
+                                            range(BITBOARD_SIZE)))
+        right, score, merges = merge_line(line[::-1])
+        right.reverse()
+        ROW_RIGHT.append(pack_row(right))
+        ROW_RIGHT_SCORE.append(score)
+        ROW_RIGHT_MERGES.append(tuple([BITBOARD_SIZE - 1 - idx
+                                       for idx in merges]))
+        ROW_RIGHT_CHANGES.append(row_changes(line, ROW_RIGHT[row], changes,
+                                             range(BITBOARD_SIZE - 1, -1, -1)))
+
+def row_changes(line, moved_row, changes, columns):
+    """
+    Return the tuple of (column, old value, new value) of the
+    squares of line that differ in the packed moved_row, in the
+    order of columns, taking each entry from the dictionary
+    changes when already there. The columns run from the edge the
+    tiles move to, as the list engine updates its lines, so both
+    engines keep their empty squares in the same order and
+    new_tile picks the same square from the same random numbers.
+    """
+    moved_line = unpack_row(moved_row)
+    result = []
+    for col in columns:
+        if moved_line[col] != line[col]:
+            change = (col, line[col], moved_line[col])
+            result.append(changes.setdefault(change, change))
+    return tuple(result)
+
+def transpose_board(board):
+    """
+    Return the packed board with rows and columns swapped
+    """
+    part1 = board & 0xF0F00F0FF0F00F0F
+    part2 = board & 0x0000F0F00000F0F0
+    part3 = board & 0x0F0F00000F0F0000
+    board = part1 | (part2 << 12) | (part3 >> 12)
+    part1 = board & 0xFF00FF0000FF00FF
+    part2 = board & 0x00FF00FF00000000
+    part3 = board & 0x00000000FF00FF00
+    return part1 | (part2 >> 24) | (part3 << 24)
+
+def move_rows(board, table):
+    """
+    Return the packed board with every row replaced by its
+    entry in the given row lookup table
+    """
+    result = 0
+    for shift in (0, 16, 32, 48):
+        result |= table[(board >> shift) & ROW_MASK] << shift
+    return result
+
+def move_board(board, direction):
+    """
+    Return the packed board after sliding and merging all tiles
+    in the given direction. Columns are moved as the rows of
+    the transposed board.
+    """
+    if direction == LEFT:
+        return move_rows(board, ROW_LEFT)
+    elif direction == RIGHT:
+        return move_rows(board, ROW_RIGHT)
+    elif direction == UP:
+        return transpose_board(move_rows(transpose_board(board), ROW_LEFT))
+    else:
+        return transpose_board(move_rows(transpose_board(board), ROW_RIGHT))
+
+def pack_board(grid):
+    """
+    Return the 4x4 grid of tile values packed into a 64-bit
+    board, or None if a tile is 32768 or more: the row tables
+    saturate at 32768, so such tiles cannot be moved correctly
+    """
+    board = 0
+    shift = 0
+    for row in grid:
+        for value in row:
+            exponent = EXPONENTS.get(value)
+            if exponent is None or exponent == MAX_EXPONENT:
+                return None
+            board |= exponent << shift
+            shift += 4
+    return board
+
+def move_packed_boards(boards, direction):
+    """
+    Move every packed board in the list boards in the given
+    direction without adding new tiles. Return the list of moved
+    boards and the list of scores gained by the merges.
+    """
+    build_row_tables()
+    horizontal = direction == LEFT or direction == RIGHT
+    if direction == LEFT or direction == UP:
+        table = ROW_LEFT
+        score_table = ROW_LEFT_SCORE
+    else:
+        table = ROW_RIGHT
+        score_table = ROW_RIGHT_SCORE
+    moved = []
+    scores = []
+    for board in boards:
+        if not horizontal:
+            board = transpose_board(board)
+        first = board & ROW_MASK
+        second = (board >> 16) & ROW_MASK
+        third = (board >> 32) & ROW_MASK
+        last = board >> 48
+        board = (table[first] | (table[second] << 16)
+                 | (table[third] << 32) | (table[last] << 48))
+        if not horizontal:
+            board = transpose_board(board)
+        moved.append(board)
+        scores.append(score_table[first] + score_table[second]
+                      + score_table[third] + score_table[last])
+    return moved, scores
+
+def board_grid(board):
+    """
+    Return the packed board as a list of rows of tile values
+    """
+    return [unpack_row((board >> (16 * row)) & ROW_MASK)
+            for row in range(BITBOARD_SIZE)]
+
+class BitboardTwentyFortyEight(TwentyFortyEight):
+    """
+    Game logic for the 4x4 board on a 64-bit packed board, moving
+    whole rows through precomputed lookup tables. Tiles are limited
+    to 32768, the largest value that fits in 4 bits.
+    """
+
+    def __init__(self, grid_height=BITBOARD_SIZE, grid_width=BITBOARD_SIZE,
+                 rng=random):
+        if grid_height != BITBOARD_SIZE or grid_width != BITBOARD_SIZE:
+            raise ValueError("bitboard engine only supports 4x4 boards")
+        build_row_tables()
+        TwentyFortyEight.__init__(self, grid_height, grid_width, rng)
+
+    def reset(self):
+        """
+        Reset the game so the grid is empty.
+        """
+        self._board = 0
+        self._score = 0
+        self._index_tiles()
+
+    def __str__(self):
+        """
+        Return a string representation of the grid for debugging.
+        """
+        return str(board_grid(self._board))
+
+    def get_board(self):
+        """
+        Return the packed 64-bit board.
+        """
+        return self._board
+
+    def move(self, direction, add_tile=True):
+        """
+        Move all tiles in the given direction and add
+        a new tile if any tiles moved, unless add_tile is False.
+        Return the MoveResult.
+        """
+        horizontal = direction == LEFT or direction == RIGHT
+        if horizontal:
+            rows = self._board
+        else:
+            rows = transpose_board(self._board)
+        if direction == LEFT or direction == UP:
+            table = ROW_LEFT
+            scores = ROW_LEFT_SCORE
+            merges = ROW_LEFT_MERGES
+            changes = ROW_LEFT_CHANGES
+        else:
+            table = ROW_RIGHT
+            scores = ROW_RIGHT_SCORE
+            merges = ROW_RIGHT_MERGES
+            changes = ROW_RIGHT_CHANGES
+        moved_rows = rows
+        score = 0
+        merged_cells = []
+        for line in range(BITBOARD_SIZE):
+            row = (rows >> (16 * line)) & ROW_MASK
+            if table[row] == row:
+                continue
+            moved_rows ^= (row ^ table[row]) << (16 * line)
+            score += scores[row]
+            # the lines are the columns of the board when moving
+            # up or down
+            if horizontal:
+                for col in merges[row]:
+                    merged_cells.append((line, col))
+                for col, old_value, value in changes[row]:
+                    self._track_tile(line * BITBOARD_SIZE + col,
+                                     old_value, value)
+            else:
+                for col in merges[row]:
+                    merged_cells.append((col, line))
+                for col, old_value, value in changes[row]:
+                    self._track_tile(col * BITBOARD_SIZE + line,
+                                     old_value, value)
+        if horizontal:
+            self._board = moved_rows
+        else:
+            self._board = transpose_board(moved_rows)
+        self._score += score
+        moved = moved_rows != rows
+        spawned = None
+        if moved and add_tile:
+            spawned = self.new_tile()
+        return MoveResult(moved, score, merged_cells, spawned)
+
+    def legal_moves(self):
+        """
+        Return the list of directions in which a move would change
+        the grid, looking up each row of the board and of its
+        transpose in the row tables.
+        """
+        columns = transpose_board(self._board)
+        legal = []
+        for direction, board, table in ((UP, columns, ROW_LEFT),
+                                        (DOWN, columns, ROW_RIGHT),
+                                        (LEFT, self._board, ROW_LEFT),
+                                        (RIGHT, self._board, ROW_RIGHT)):
+            for shift in (0, 16, 32, 48):
+                row = (board >> shift) & ROW_MASK
+                if table[row] != row:
+                    legal.append(direction)
+                    break
+        return legal
+
+    def is_game_over(self):
+        """
+        Return True if no move can change the grid.
+        """
+        if self._empty:
+            return len(self._empty) == BITBOARD_SIZE * BITBOARD_SIZE
+        return not self.legal_moves()
+
+    def preview(self, direction):
+        """
+        Return the grid, as a list of rows, that moving in the given
+        direction would leave before the new tile is added. The game
+        is not changed.
+        """
+        return board_grid(move_board(self._board, direction))
+
+    def preview_all(self):
+        """
+        Return a dictionary mapping each direction to the grid that
+        preview would return for it, transposing the board once for
+        both vertical directions.
+        """
+        columns = transpose_board(self._board)
+        return {
+            UP: board_grid(transpose_board(move_rows(columns, ROW_LEFT))),
+            DOWN: board_grid(transpose_board(move_rows(columns, ROW_RIGHT))),
+            LEFT: board_grid(move_rows(self._board, ROW_LEFT)),
+            RIGHT: board_grid(move_rows(self._board, ROW_RIGHT))}
+
+    def set_tile(self, row, col, value):
+        """
+        Set the tile at position row, col to have the given value.
+        """
+        shift = 16 * row + 4 * col
+        self._track_tile(row * BITBOARD_SIZE + col, self.get_tile(row, col),
+                         value)
+        self._board = ((self._board & ~(0xF << shift))
+                       | (EXPONENTS[value] << shift))
+
+    def get_tile(self, row, col):
+        """
+        Return the value of the tile at position row, col.
+        """
+        return TILE_VALUES[(self._board >> (16 * row + 4 * col)) & 0xF]
+
+    def snapshot(self):
+        """
+        Return the packed board and score that restore can bring
+        the game back to.
+        """
+        return self._board, self._score
+
+    def restore(self, snapshot):
+        """
+        Bring the game back to a snapshot.
+        """
+        self._board, self._score = snapshot
+        self._index_tiles()
+
+def create_game(grid_height, grid_width, use_bitboard=True, rng=random):
+    """
+    Return a new game, using the bitboard engine for 4x4 boards
+    unless use_bitboard is False.
+    """
+    if (use_bitboard and grid_height == BITBOARD_SIZE
+            and grid_width == BITBOARD_SIZE):
+        return BitboardTwentyFortyEight(grid_height, grid_width, rng)
+    return TwentyFortyEight(grid_height, grid_width, rng)
+
+# Values of a new tile with their probabilities, matching new_tile
+NEW_TILE_PROBABILITIES = ((2, 0.9), (4, 0.1))
+
+def get_state(game):
+    """
+    Return the grid of the given game as a tuple of row tuples,
+    usable as a dictionary key
+    """
+    return tuple([tuple([game.get_tile(row, col)
+                         for col in range(game.get_grid_width())])
+                  for row in range(game.get_grid_height())])
+
+def move_state(state, direction):
+    """
+    Return the state after sliding and merging all tiles in the
+    given direction, without adding a new tile
+    """
+    if direction == UP or direction == DOWN:
+        lines = zip(*state)
+    else:
+        lines = state
+    if direction == LEFT or direction == UP:
+        moved = [merge(list(line)) for line in lines]
+    else:
+        moved = [merge(list(line)[::-1])[::-1] for line in lines]
+    if direction == UP or direction == DOWN:
+        moved = zip(*moved)
+    return tuple([tuple(line) for line in moved])
+
+# The 8 symmetries of a square grid as (transpose, reverse the row
+# order, reverse each row) applied in that order. Grids that are
+# not square only have the 4 symmetries without a transpose.
+SYMMETRIES = [(transpose, flip_rows, flip_cols)
+              for transpose in (False, True)
+              for flip_rows in (False, True)
+              for flip_cols in (False, True)]
+TRANSPOSED = {UP: LEFT, LEFT: UP, DOWN: RIGHT, RIGHT: DOWN}
+ROWS_FLIPPED = {UP: DOWN, DOWN: UP, LEFT: LEFT, RIGHT: RIGHT}
+COLS_FLIPPED = {UP: UP, DOWN: DOWN, LEFT: RIGHT, RIGHT: LEFT}
+
+def transform_state(state, symmetry):
+    """
+    Return the state transformed by the symmetry with the given
+    index in SYMMETRIES
+    """
+    transpose, flip_rows, flip_cols = SYMMETRIES[symmetry]
+    if transpose:
+        state = tuple(zip(*state))
+    if flip_rows:
+        state = state[::-1]
+    if flip_cols:
+        state = tuple([row[::-1] for row in state])
+    return state
+
+def transform_direction(direction, symmetry):
+    """
+    Return the direction that moves the transformed state the way
+    direction moves the original one
+    """
+    transpose, flip_rows, flip_cols = SYMMETRIES[symmetry]
+    if transpose:
+        direction = TRANSPOSED[direction]
+    if flip_rows:
+        direction = ROWS_FLIPPED[direction]
+    if flip_cols:
+        direction = COLS_FLIPPED[direction]
+    return direction
+
+def inverse_direction(direction, symmetry):
+    """
+    Return the direction in the original state corresponding to
+    direction in the transformed state
+    """
+    transpose, flip_rows, flip_cols = SYMMETRIES[symmetry]
+    if flip_cols:
+        direction = COLS_FLIPPED[direction]
+    if flip_rows:
+        direction = ROWS_FLIPPED[direction]
+    if transpose:
+        direction = TRANSPOSED[direction]
+    return direction
+
+def canonical_state(state):
+    """
+    Return the smallest of the symmetric images of state and the
+    index of the symmetry producing it. Positions that are the same
+    up to rotation or reflection share one canonical state.
+    """
+    if len(state) == len(state[0]):
+        symmetries = range(len(SYMMETRIES))
+    else:
+        symmetries = range(len(SYMMETRIES) // 2)
+    best = state
+    best_symmetry = 0
+    for symmetry in symmetries:
+        image = transform_state(state, symmetry)
+        if image < best:
+            best = image
+            best_symmetry = symmetry
+    return best, best_symmetry
+
+class TranspositionTable:
+    """
+    Search results keyed on the state. With symmetric set, entries
+    are keyed on the canonical state, so the 8 rotations and
+    reflections of a position share one entry; stored best moves are
+    mapped into the canonical frame and back. Values must then come
+    from an evaluation that does not depend on the orientation.
+    """
+
+    def __init__(self, symmetric=True):
+        self._symmetric = symmetric
+        self._entries = {}
+
+    def store(self, state, depth, value, best_move=None):
+        """
+        Record the value of state searched to the given depth and
+        optionally the best direction to move in.
+        """
+        if self._symmetric:
+            state, symmetry = canonical_state(state)
+            if best_move is not None:
+                best_move = transform_direction(best_move, symmetry)
+        self._entries[state] = (depth, value, best_move)
+
+    def lookup(self, state):
+        """
+        Return the (depth, value, best move) recorded for state,
+        or None.
+        """
+        symmetry = 0
+        if self._symmetric:
+            state, symmetry = canonical_state(state)
+        entry = self._entries.get(state)
+        if entry is None or entry[2] is None or symmetry == 0:
+            return entry
+        return entry[0], entry[1], inverse_direction(entry[2], symmetry)
+
+    def get_size(self):
+        """
+        Return the number of entries in the table.
+        """
+        return len(self._entries)
+
+    def clear(self):
+        """
+        Remove all entries.
+        """
+        self._entries = {}
+
+def count_empty(state):
+    """
+    Default heuristic for the expectimax player: the number
+    of empty squares in the state
+    """
+    return float(sum([list(row).count(0) for row in state]))
+
+# Features of a line scored by the heuristic evaluator, in the order
+# line_features returns them, and the default weight of each. The
+# corner feature is scored on the whole grid and base is added to
+# every value.
+LINE_FEATURES = ("monotonicity", "smoothness", "empty", "merges")
+DEFAULT_WEIGHTS = {"base": 1000.0, "monotonicity": 1.0, "smoothness": 0.1,
+                   "empty": 2.7, "merges": 1.0, "corner": 1.0}
+
+# Number of distinct lines whose weighted features a heuristic
+# evaluator keeps; the cache is emptied when it fills up
+LINE_VALUE_CACHE_SIZE = 200000
+
+# Features and largest exponent of each of the 65536 packed rows,
+# filled on first use
+ROW_FEATURES = []
+ROW_MAX_EXPONENT = []
+
+def line_features(exponents):
+    """
+    Return the features of a line of tile exponents (0 for an
+    empty square): minus the smaller of its total rise and total
+    fall, minus the differences between neighbouring tiles, the
+    number of empty squares and the number of neighbouring tiles
+    that could merge. None depends on the direction the line is
+    read in.
+    """
+    rise = 0
+    fall = 0
+    for idx in range(len(exponents) - 1):
+        step = exponents[idx + 1] - exponents[idx]
+        if step > 0:
+            rise += step
+        else:
+            fall -= step
+    tiles = [exponent for exponent in exponents if exponent != 0]
+    smoothness = 0
+    merges = 0
+    for idx in range(len(tiles) - 1):
+        smoothness -= abs(tiles[idx + 1] - tiles[idx])
+        if tiles[idx + 1] == tiles[idx]:
+            merges += 1
+    return -min(rise, fall), smoothness, len(exponents) - len(tiles), merges
+
+def build_feature_tables():
+    """
+    Fill ROW_FEATURES and ROW_MAX_EXPONENT for every packed row.
+    """
+    if ROW_FEATURES:
+        return
+    for row in range(ROW_MASK + 1):
+        exponents = [(row >> (4 * idx)) & 0xF for idx in range(BITBOARD_SIZE)]
+        ROW_FEATURES.append(line_features(exponents))
+        ROW_MAX_EXPONENT.append(max(exponents))
+
+class HeuristicEvaluator:
+    """
+    Static evaluation of a position: the weighted features of all
+    its rows and columns, plus the exponent of the largest tile
+    times the corner weight when that tile sits in a corner. Every
+    term is unchanged by rotating or reflecting the grid, so the
+    evaluator can back a symmetric transposition table. The base
+    weight keeps positions in play above the 0 the expectimax
+    player gives lost ones.
+
+    Instances are called with a state, so they can be passed as the
+    evaluate function of ExpectimaxPlayer. Packed 4x4 boards are
+    scored through per-row tables of the weighted features, and
+    arrays of boards by evaluate_arrays in vectorized_2048.
+    """
+
+    def __init__(self, weights=None):
+        self._weights = dict(DEFAULT_WEIGHTS)
+        if weights is not None:
+            for name in weights:
+                if name not in DEFAULT_WEIGHTS:
+                    raise ValueError("unknown heuristic weight " + str(name))
+            self._weights.update(weights)
+        # every square is in one row and one column, so empty
+        # squares count for half their weight in each line
+        self._line_weights = [self._weights[name] for name in LINE_FEATURES]
+        self._line_weights[LINE_FEATURES.index("empty")] /= 2.0
+        self._line_values = {}
+        self._row_values = []
+
+    def get_weights(self):
+        """
+        Return a dictionary of the weights of the evaluator.
+        """
+        return dict(self._weights)
+
+    def _line_value(self, features):
+        """
+        Return the weighted sum of the features of a line
+        """
+        value = 0.0
+        for idx in range(len(features)):
+            value += self._line_weights[idx] * features[idx]
+        return value
+
+    def __call__(self, state):
+        """
+        Return the value of a state, a tuple of row tuples.
+        """
+        values = self._line_values
+        total = self._weights["base"]
+        for line in list(state) + list(zip(*state)):
+            value = values.get(line)
+            if value is None:
+                if len(values) >= LINE_VALUE_CACHE_SIZE:
+                    values.clear()
+                value = self._line_value(line_features(
+                    [tile_exponent(tile) for tile in line]))
+                values[line] = value
+            total += value
+        largest = max([max(row) for row in state])
+        if largest != 0 and largest in (state[0][0], state[0][-1],
+                                        state[-1][0], state[-1][-1]):
+            total += self._weights["corner"] * tile_exponent(largest)
+        return total
+
+    def evaluate_board(self, board):
+        """
+        Return the value of a packed 4x4 board.
+        """
+        return self.evaluate_boards([board])[0]
+
+    def evaluate_boards(self, boards):
+        """
+        Return the list of values of a list of packed 4x4 boards,
+        looking up the weighted features of each row and column.
+        """
+        if not self._row_values:
+            build_feature_tables()
+            self._row_values = [self._line_value(features)
+                                for features in ROW_FEATURES]
+        row_values = self._row_values
+        row_max = ROW_MAX_EXPONENT
+        base = self._weights["base"]
+        corner = self._weights["corner"]
+        values = []
+        for board in boards:
+            columns = transpose_board(board)
+            first = board & ROW_MASK
+            second = (board >> 16) & ROW_MASK
+            third = (board >> 32) & ROW_MASK
+            last = board >> 48
+            total = (base + row_values[first] + row_values[second]
+                     + row_values[third] + row_values[last]
+                     + row_values[columns & ROW_MASK]
+                     + row_values[(columns >> 16) & ROW_MASK]
+                     + row_values[(columns >> 32) & ROW_MASK]
+                     + row_values[columns >> 48])
+            largest = max(row_max[first], row_max[second], row_max[third],
+                          row_max[last])
+            if largest != 0 and largest in (board & 0xF, (board >> 12) & 0xF,
+                                            (board >> 48) & 0xF, board >> 60):
+                total += corner * largest
+            values.append(total)
+        return values
+
+class SearchTimeout(Exception):
+    """
+    Raised when a search runs out of its time budget
+    """
+    pass
+
+class ExpectimaxPlayer:
+    """
+    Choose moves by expectimax search over the game tree where the
+    player picks the best direction and the game adds a 2 or a 4 in
+    a random empty square. Searches deepen one move at a time until
+    the time budget (in milliseconds) for the move is used up. With
+    symmetric_cache set, positions equal up to rotation or reflection
+    share their cache entry.
+    """
+
+    def __init__(self, time_budget=100, max_depth=6,
+                 min_probability=0.0001, evaluate=count_empty,
+                 symmetric_cache=False):
+        self._time_budget = time_budget
+        self._max_depth = max_depth
+        self._min_probability = min_probability
+        self._evaluate = evaluate
+        self._cache = TranspositionTable(symmetric_cache)
+        self._deadline = None
+
+    def choose_move(self, game):
+        """
+        Return the best direction to move in for the given game,
+        or None if no direction changes the grid.
+        """
+        state = get_state(game)
+        best_move = None
+        self._cache.clear()
+        self._deadline = None
+        start = time.time()
+        for depth in range(1, self._max_depth + 1):
+            try:
+                move = self._best_move(state, depth)
+            except SearchTimeout:
+                break
+            if move is None:
+                return None
+            best_move = move
+            # the first search always completes, deeper ones may not
+            self._deadline = start + self._time_budget / 1000.0
+            if time.time() >= self._deadline:
+                break
+        return best_move
+
+    def _best_move(self, state, depth):
+        """
+        Return the direction with the best expected value when
+        searching depth moves ahead
+        """
+        best_move = None
+        best_value = None
+        for direction in (UP, DOWN, LEFT, RIGHT):
+            child = move_state(state, direction)
+            if child != state:
+                value = self._chance_value(child, depth, 1.0)
+                if best_value is None or value > best_value:
+                    best_move = direction
+                    best_value = value
+        return best_move
+
+    def _max_value(self, state, depth, probability):
+        """
+        Return the value of the best move from state
+        """
+        best_value = 0.0
+        for direction in (UP, DOWN, LEFT, RIGHT):
+            child = move_state(state, direction)
+            if child != state:
+                best_value = max(best_value,
+                                 self._chance_value(child, depth, probability))
+        return best_value
+
+    def _chance_value(self, state, depth, probability):
+        """
+        Return the expected value of state over the new tiles the
+        game may add. Searches stop at the depth limit and in
+        branches reached with less than min_probability.
+        """
+        if depth <= 1 or probability < self._min_probability:
+            return self._evaluate(state)
+        if self._deadline is not None and time.time() >= self._deadline:
+            raise SearchTimeout()
+        cached = self._cache.lookup(state)
+        if cached is not None and cached[0] >= depth:
+            return cached[1]
+
+        empty = [(row, col) for row in range(len(state))
+                 for col in range(len(state[row])) if state[row][col] == 0]
+        total = 0.0
+        for row, col in empty:
+            for value, tile_probability in NEW_TILE_PROBABILITIES:
+                line = list(state[row])
+                line[col] = value
+                child = state[:row] + (tuple(line),) + state[row + 1:]
+                child_probability = probability * tile_probability / len(empty)
+                total += tile_probability * self._max_value(
+                    child, depth - 1, child_probability)
+        if empty:
+            total /= len(empty)
+        self._cache.store(state, depth, total)
+        return total
+
+def run_playouts(task):
+    """
+    Play random games from a state after a first move and return
+    the total score they made and the number of games played. The
+    task is a tuple (state, first direction, number of playouts,
+    moves per playout after the first one, seed, deadline). Once
+    the time.time() deadline has passed no further playout starts,
+    though at least one is always played; a deadline of None plays
+    them all. Takes a single argument so it can be handed to the
+    map function of a process pool.
+    """
+    state, direction, count, depth_limit, seed, deadline = task
+    rng = random.Random(seed)
+    game = create_game(len(state), len(state[0]), rng=rng)
+    for row in range(len(state)):
+        for col in range(len(state[0])):
+            if state[row][col] != 0:
+                game.set_tile(row, col, state[row][col])
+    start = game.snapshot()
+    total = 0
+    playouts = 0
+    while playouts < count:
+        if (playouts > 0 and deadline is not None
+                and time.time() >= deadline):
+            break
+        playouts += 1
+        game.restore(start)
+        total += game.move(direction).score
+        for dummy_step in range(depth_limit):
+            legal = game.legal_moves()
+            if not legal:
+                break
+            total += game.move(rng.choice(legal)).score
+    return total, playouts
+
+class MonteCarloPlayer:
+    """
+    Choose moves by random playouts: for each legal direction play
+    random games of up to depth_limit moves after it and pick the
+    direction with the best average score. Playouts run in batches of
+    batch_size per direction until the time budget (in milliseconds)
+    for the move is used up or max_playouts per direction are done;
+    batches stop early at the deadline, overrunning it by at most one
+    playout per direction. Batches go through map_function, which can
+    be the map method of a process pool when the module is loaded
+    with headless_2048.
+    """
+
+    def __init__(self, time_budget=100, depth_limit=20, batch_size=10,
+                 max_playouts=None, rng=random, map_function=map):
+        self._time_budget = time_budget
+        self._depth_limit = depth_limit
+        self._batch_size = batch_size
+        self._max_playouts = max_playouts
+        self._rng = rng
+        self._map = map_function
+
+    def choose_move(self, game):
+        """
+        Return the direction with the best average playout score
+        for the given game, or None if no direction changes the grid.
+        """
+        legal = game.legal_moves()
+        if not legal:
+            return None
+        if len(legal) == 1:
+            return legal[0]
+        state = get_state(game)
+        totals = dict([(direction, 0) for direction in legal])
+        counts = dict([(direction, 0) for direction in legal])
+        batches = 0
+        deadline = time.time() + self._time_budget / 1000.0
+        while True:
+            tasks = [(state, direction, self._batch_size, self._depth_limit,
+                      self._rng.randrange(2 ** 30), deadline)
+                     for direction in legal]
+            for direction, result in zip(legal, self._map(run_playouts, tasks)):
+                totals[direction] += result[0]
+                counts[direction] += result[1]
+            batches += 1
+            if time.time() >= deadline:
+                break
+            if (self._max_playouts is not None
+                    and batches * self._batch_size >= self._max_playouts):
+                break
+        best_move = legal[0]
+        for direction in legal:
+            if (totals[direction] * counts[best_move]
+                    > totals[best_move] * counts[direction]):
+                best_move = direction
+        return best_move
+
+# Record types of the replay format. Each record starts with a byte
+# holding its type in the high nibble; the low nibble holds the
+# direction of a move or the exponent of a new tile. Varints follow:
+# height, width and seed + 1 (0 for no seed) for a game, the flat
+# index of the square for a new tile and the final score for the
+# end of a game.
+REPLAY_GAME = 0x10
+REPLAY_MOVE = 0x20
+REPLAY_TILE = 0x30
+REPLAY_END = 0x40
+
+class ReplayWriter:
+    """
+    Append games to a binary stream (anything with a write method
+    taking bytes) as a sequence of replay records: the start of a
+    game, the tiles added and the directions played, in order.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._width = None
+
+    def start_game(self, grid_height, grid_width, seed=None):
+        """
+        Record the start of a game of the given size.
+        """
+        data = bytearray([REPLAY_GAME])
+        write_varint(data, grid_height)
+        write_varint(data, grid_width)
+        if seed is None:
+            write_varint(data, 0)
+        else:
+            write_varint(data, seed + 1)
+        self._stream.write(bytes(data))
+        self._width = grid_width
+
+    def record_tile(self, tile):
+        """
+        Record a tile (row, col, value) added to the grid, as
+        returned by new_tile. None is ignored.
+        """
+        if tile is None:
+            return
+        row, col, value = tile
+        data = bytearray([REPLAY_TILE | tile_exponent(value)])
+        write_varint(data, row * self._width + col)
+        self._stream.write(bytes(data))
+
+    def record_move(self, direction, result=None):
+        """
+        Record a move and the tile added by it, as reported by
+        its MoveResult.
+        """
+        self._stream.write(bytes(bytearray([REPLAY_MOVE | direction])))
+        if result is not None:
+            self.record_tile(result.spawned)
+
+    def end_game(self, score):
+        """
+        Record the end of the current game with its final score.
+        """
+        data = bytearray([REPLAY_END])
+        write_varint(data, score)
+        self._stream.write(bytes(data))
+
+    def play(self, game, direction):
+        """
+        Move the game in the given direction, record the move and
+        return its MoveResult.
+        """
+        result = game.move(direction)
+        self.record_move(direction, result)
+        return result
+
+class ReplayReader:
+    """
+    Read the records written by a ReplayWriter from a binary stream
+    (anything with a read method), a block at a time. Iterating
+    yields ("game", height, width, seed), ("tile", row, col, value),
+    ("move", direction) and ("end", score) tuples.
+    """
+
+    def __init__(self, stream, block_size=65536):
+        self._stream = stream
+        self._block_size = block_size
+        self._buffer = bytearray()
+        self._position = 0
+
+    def _read_byte(self):
+        """
+        Return the next byte of the stream, or None at its end
+        """
+        if self._position >= len(self._buffer):
+            self._buffer = bytearray(self._stream.read(self._block_size))
+            self._position = 0
+            if not self._buffer:
+                return None
+        byte = self._buffer[self._position]
+        self._position += 1
+        return byte
+
+    def _read_varint(self):
+        """
+        Return the next varint of the stream
+        """
+        value = 0
+        shift = 0
+        while True:
+            byte = self._read_byte()
+            if byte is None:
+                raise ValueError("replay ends inside a record")
+            value |= (byte & 0x7F) << shift
+            shift += 7
+            if byte < 0x80:
+                return value
+
+    def __iter__(self):
+        """
+        Yield the records of the stream in order
+        """
+        width = None
+        while True:
+            tag = self._read_byte()
+            if tag is None:
+                return
+            kind = tag & 0xF0
+            if kind == REPLAY_GAME:
+                height = self._read_varint()
+                width = self._read_varint()
+                seed = self._read_varint() - 1
+                if seed < 0:
+                    seed = None
+                yield ("game", height, width, seed)
+            elif kind == REPLAY_MOVE:
+                yield ("move", tag & 0xF)
+            elif kind == REPLAY_TILE:
+                row, col = divmod(self._read_varint(), width)
+                yield ("tile", row, col, 2 ** (tag & 0xF))
+            elif kind == REPLAY_END:
+                yield ("end", self._read_varint())
+            else:
+                raise ValueError("unknown replay record " + hex(tag))
+
+def replay_games(records, use_bitboard=True):
+    """
+    Re-execute the games in an iterable of replay records (such as a
+    ReplayReader) without the GUI, placing the recorded tiles instead
+    of random ones. Yield a (game, number of moves) pair for each
+    finished game; raise ValueError if a final score differs from the
+    recorded one.
+    """
+    game = None
+    moves = 0
+    for record in records:
+        kind = record[0]
+        if kind == "game":
+            game = create_game(record[1], record[2], use_bitboard)
+            moves = 0
+        elif kind == "tile":
+            game.set_tile(record[1], record[2], record[3])
+        elif kind == "move":
+            game.move(record[1], False)
+            moves += 1
+        elif kind == "end":
+            if game.get_score() != record[1]:
+                raise ValueError("replay scored " + str(game.get_score())
+                                 + " instead of " + str(record[1]))
+            yield game, moves
+
+class Instrumentation:
+    """
+    Opt-in call counts and cumulative nanoseconds for the hot paths
+    of the game logic: slide, merged, merge, merge_line, the merge
+    cache and the move, new_tile, get_tile and set_tile methods of
+    both engines. enable replaces them with timed wrappers and
+    disable puts the originals back, so nothing is measured or
+    slowed down while disabled. Times of stages calling each other
+    overlap; a move includes its merge cache lookups.
+    """
+
+    FUNCTIONS = ("slide", "merged", "merge", "merge_line")
+    METHODS = ("move", "new_tile", "get_tile", "set_tile")
+
+    def __init__(self):
+        self._timer = getattr(time, "perf_counter", time.time)
+        self._originals = []
+        self._calls = {}
+        self._nanoseconds = {}
+
+    def is_enabled(self):
+        """
+        Return True while the hot paths are being measured.
+        """
+        return len(self._originals) > 0
+
+    def enable(self):
+        """
+        Start measuring the hot paths.
+        """
+        if self.is_enabled():
+            return
+        namespace = globals()
+        for name in self.FUNCTIONS:
+            self._originals.append((namespace, name, namespace[name]))
+            namespace[name] = self._wrap(name, namespace[name])
+        targets = [(LineCache, "merge_line")]
+        for cls in (TwentyFortyEight, BitboardTwentyFortyEight):
+            targets.extend([(cls, name) for name in self.METHODS])
+        for cls, name in targets:
+            if name in cls.__dict__:
+                original = cls.__dict__[name]
+                self._originals.append((cls, name, original))
+                setattr(cls, name, self._wrap(cls.__name__ + "." + name,
+                                              original))
+
+    def disable(self):
+        """
+        Stop measuring and restore the original functions, keeping
+        the statistics gathered so far.
+        """
+        for target, name, original in self._originals:
+            if isinstance(target, dict):
+                target[name] = original
+            else:
+                setattr(target, name, original)
+        self._originals = []
+
+    def reset(self):
+        """
+        Clear the statistics. The counters are zeroed in place, since
+        the wrappers of an enabled instrumentation hold on to them.
+        """
+        for stage in self._calls:
+            self._calls[stage] = 0
+            self._nanoseconds[stage] = 0
+
+    def _wrap(self, stage, function):
+        """
+        Return function wrapped to count its calls and time under
+        the given stage name
+        """
+        calls = self._calls
+        nanoseconds = self._nanoseconds
+        timer = self._timer
+        calls[stage] = calls.get(stage, 0)
+        nanoseconds[stage] = nanoseconds.get(stage, 0)
+
+        def timed(*args, **kwargs):
+            """
+            Call the wrapped function and record its time
+            """
+            start = timer()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                calls[stage] += 1
+                nanoseconds[stage] += int((timer() - start) * 1e9)
+        return timed
+
+    def get_stats(self):
+        """
+        Return a dictionary mapping each stage that was called to
+        a dictionary with its call count and total nanoseconds.
+        """
+        return dict([(stage, {"calls": self._calls[stage],
+                              "nanoseconds": self._nanoseconds[stage]})
+                     for stage in self._calls if self._calls[stage]])
+
+    def to_prometheus(self, prefix="twenty_forty_eight"):
+        """
+        Return the statistics in the Prometheus text format.
+        """
+        stats = self.get_stats()
+        stages = sorted(stats.keys())
+        lines = []
+        for key, text in (("calls", "Calls"),
+                          ("nanoseconds", "Cumulative nanoseconds")):
+            name = prefix + "_stage_" + key + "_total"
+            lines.append("# HELP " + name + " " + text
+                         + " per instrumented stage")
+            lines.append("# TYPE " + name + " counter")
+            for stage in stages:
+                lines.append(name + '{stage="' + stage + '"} '
+                             + str(stats[stage][key]))
+        return "\n".join(lines) + "\n"
+
+INSTRUMENTATION = Instrumentation()
+
 #my testing
 #game = TwentyFortyEight(4,4)
 #game.set_tile(0,0,2)
@@ -0,0 +1,307 @@
+"""
+Benchmark the 2048 game logic and write the results as JSON.
+
+Measures merge per line, move per board, batches of moves, new_tile on
+sparse and dense boards and full random games per second on 4x4, 5x5
+and 8x8 boards, for the list engine and, on 4x4, the bitboard engine.
+Batches also run through the NumPy kernel when NumPy is installed. All
+inputs come from fixed seeds so runs are comparable across commits.
+Before timing, seeded 4x4 games are played on both engines side by
+side to check that they stay identical move for move.
+
+Example:
+    python benchmark_2048.py --output bench.json
+"""
+
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+
+import headless_2048
+
+game_logic = headless_2048.load_game()
+
+try:
+    import numpy
+    import vectorized_2048
+except ImportError:
+    numpy = None
+
+timer = getattr(time, "perf_counter", time.time)
+
+SIZES = ((4, 4), (5, 5), (8, 8))
+# random play on large boards can go on for a very long time, so
+# games stop after this many moves
+MAX_GAME_MOVES = 2000
+TILES = (0, 0, 0, 2, 2, 4, 8, 16, 32, 64)
+
+
+def engines(height, width):
+    """
+    Return the (name, use_bitboard) engines to run on a board size
+    """
+    if (height, width) == (game_logic.BITBOARD_SIZE,
+                           game_logic.BITBOARD_SIZE):
+        return [("list", False), ("bitboard", True)]
+    return [("list", False)]
+
+
+def random_state(rng, height, width, empty_squares=None):
+    """
+    Return a random state, with the given number of empty squares
+    if given
+    """
+    cells = [rng.choice(TILES) for dummy in range(height * width)]
+    if empty_squares is not None:
+        cells = [rng.choice(TILES[3:]) for dummy in range(height * width)]
+        for idx in rng.sample(range(height * width), empty_squares):
+            cells[idx] = 0
+    return tuple([tuple(cells[row * width:(row + 1) * width])
+                  for row in range(height)])
+
+
+def load_state(game, state):
+    """
+    Set the tiles of an empty game to the given state
+    """
+    for row in range(len(state)):
+        for col in range(len(state[0])):
+            if state[row][col] != 0:
+                game.set_tile(row, col, state[row][col])
+
+
+def result(name, engine, height, width, operations, seconds):
+    """
+    Return the result record of one benchmark
+    """
+    return {"benchmark": name, "engine": engine,
+            "size": "%dx%d" % (height, width), "operations": operations,
+            "seconds": seconds,
+            "per_second": operations / seconds if seconds else None}
+
+
+def bench_merge(rng, width, count):
+    """
+    Time merge_line and the cached merge on random lines, first
+    from an empty cache and then again with every line cached
+    """
+    lines = [[rng.choice(TILES) for dummy in range(width)]
+             for dummy in range(count)]
+    start = timer()
+    for line in lines:
+        game_logic.merge_line(line)
+    uncached = timer() - start
+    game_logic.MERGE_CACHE.clear()
+    start = timer()
+    for line in lines:
+        game_logic.merge(line)
+    cold = timer() - start
+    start = timer()
+    for line in lines:
+        game_logic.merge(line)
+    warm = timer() - start
+    return [result("merge_line", "list", 1, width, count, uncached),
+            result("merge", "list", 1, width, count, cold),
+            result("merge_warm", "list", 1, width, count, warm)]
+
+
+def bench_move(rng, height, width, count):
+    """
+    Time move on random boards, restoring each board before its
+    move outside the timing
+    """
+    states = [random_state(rng, height, width) for dummy in range(count)]
+    directions = [rng.choice((game_logic.UP, game_logic.DOWN,
+                              game_logic.LEFT, game_logic.RIGHT))
+                  for dummy in range(count)]
+    results = []
+    for engine, use_bitboard in engines(height, width):
+        game = game_logic.create_game(height, width, use_bitboard,
+                                      random.Random(0))
+        snapshots = []
+        for state in states:
+            game.reset()
+            load_state(game, state)
+            snapshots.append(game.snapshot())
+        elapsed = 0.0
+        for idx in range(count):
+            game.restore(snapshots[idx])
+            start = timer()
+            game.move(directions[idx])
+            elapsed += timer() - start
+        results.append(result("move", engine, height, width, count, elapsed))
+    return results
+
+
+def bench_batch(rng, height, width, count):
+    """
+    Time moving a batch of random boards in every direction with
+    move_boards, move_packed_boards on 4x4 and move_arrays when
+    NumPy is installed
+    """
+    states = [random_state(rng, height, width) for dummy in range(count)]
+    grids = [[list(row) for row in state] for state in states]
+    runs = [("list", game_logic.move_boards, grids)]
+    if (height, width) == (game_logic.BITBOARD_SIZE, game_logic.BITBOARD_SIZE):
+        game_logic.build_row_tables()
+        runs.append(("bitboard", game_logic.move_packed_boards,
+                     [game_logic.pack_board(grid) for grid in grids]))
+    if numpy is not None:
+        runs.append(("numpy", vectorized_2048.move_arrays,
+                     numpy.array(grids, dtype=numpy.int64)))
+    results = []
+    for engine, move_batch, boards in runs:
+        start = timer()
+        for direction in (game_logic.UP, game_logic.DOWN,
+                          game_logic.LEFT, game_logic.RIGHT):
+            move_batch(boards, direction)
+        elapsed = timer() - start
+        results.append(result("move_batch", engine, height, width,
+                              4 * count, elapsed))
+    return results
+
+
+def bench_new_tile(rng, height, width, count):
+    """
+    Time new_tile on sparse boards (two tiles) and dense boards
+    (one empty square)
+    """
+    results = []
+    for name, empty_squares in (("new_tile_sparse", height * width - 2),
+                                ("new_tile_dense", 1)):
+        states = [random_state(rng, height, width, empty_squares)
+                  for dummy in range(count)]
+        for engine, use_bitboard in engines(height, width):
+            game = game_logic.create_game(height, width, use_bitboard,
+                                          random.Random(0))
+            snapshots = []
+            for state in states:
+                game.reset()
+                load_state(game, state)
+                snapshots.append(game.snapshot())
+            elapsed = 0.0
+            for snapshot in snapshots:
+                game.restore(snapshot)
+                start = timer()
+                game.new_tile()
+                elapsed += timer() - start
+            results.append(result(name, engine, height, width, count,
+                                  elapsed))
+    return results
+
+
+def check_parity(seed, count):
+    """
+    Play count seeded 4x4 games with random legal moves on the
+    list and bitboard engines side by side and raise ValueError
+    when their grids, legal moves, scores or new tiles differ
+    after any move
+    """
+    size = game_logic.BITBOARD_SIZE
+    for game_number in range(count):
+        games = [game_logic.create_game(size, size, use_bitboard,
+                                        random.Random(seed + game_number))
+                 for engine, use_bitboard in engines(size, size)]
+        policy_rng = random.Random(seed)
+        spawned = [(game.new_tile(), game.new_tile()) for game in games]
+        game_moves = 0
+        while True:
+            states = [(str(games[idx]), games[idx].legal_moves(),
+                       games[idx].get_score(), spawned[idx])
+                      for idx in range(len(games))]
+            if states[0] != states[1]:
+                raise ValueError("engines differ in game %d after %d moves"
+                                 % (seed + game_number, game_moves))
+            legal = states[0][1]
+            if not legal or game_moves == MAX_GAME_MOVES:
+                break
+            direction = policy_rng.choice(legal)
+            spawned = [game.move(direction).spawned for game in games]
+            game_moves += 1
+
+
+def bench_games(seed, height, width, count):
+    """
+    Time full games played with random legal moves, up to
+    MAX_GAME_MOVES moves each. Every engine plays the same games
+    from the same seeds, as check_parity makes sure on 4x4.
+    """
+    results = []
+    for engine, use_bitboard in engines(height, width):
+        policy_rng = random.Random(seed)
+        moves = 0
+        start = timer()
+        for game_number in range(count):
+            game = game_logic.create_game(height, width, use_bitboard,
+                                          random.Random(seed + game_number))
+            game.new_tile()
+            game.new_tile()
+            legal = game.legal_moves()
+            game_moves = 0
+            while legal and game_moves < MAX_GAME_MOVES:
+                game.move(policy_rng.choice(legal))
+                game_moves += 1
+                legal = game.legal_moves()
+            moves += game_moves
+        elapsed = timer() - start
+        results.append(result("random_game", engine, height, width, count,
+                              elapsed))
+        results.append(result("random_game_moves", engine, height, width,
+                              moves, elapsed))
+    return results
+
+
+def run_benchmarks(seed=0, scale=1.0):
+    """
+    Run every benchmark and return the list of result records
+    """
+    game_logic.build_row_tables()
+    check_parity(seed, max(1, int(20 * scale)))
+    rng = random.Random(seed)
+    results = []
+    for height, width in SIZES:
+        results.extend(bench_merge(rng, width, int(20000 * scale)))
+        results.extend(bench_move(rng, height, width, int(5000 * scale)))
+        results.extend(bench_batch(rng, height, width, int(50000 * scale)))
+        results.extend(bench_new_tile(rng, height, width, int(5000 * scale)))
+        results.extend(bench_games(seed, height, width,
+                                   max(1, int(20 * scale))))
+    return results
+
+
+def main():
+    """
+    Run the benchmarks from the command line
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the 2048 logic")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="multiplier for the number of operations")
+    parser.add_argument("--output", default=None,
+                        help="JSON file receiving the results")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.seed, args.scale)
+    for record in results:
+        print("%-18s %-8s %-4s %12.0f /s" % (record["benchmark"],
+                                              record["engine"],
+                                              record["size"],
+                                              record["per_second"] or 0))
+    if args.output:
+        report = {"python": sys.version.split()[0],
+                  "platform": platform.platform(),
+                  "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                  "seed": args.seed, "scale": args.scale,
+                  "results": results}
+        output = open(args.output, "w")
+        try:
+            json.dump(report, output, indent=2, sort_keys=True)
+        finally:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+Load the 2048 game logic from '2048 game.py' outside CodeSkulptor.
+
+The game file imports the CodeSkulptor GUI module, which only exists
+in the browser, so it is loaded with that import left out and
+registered as a regular module. Registering it lets worker processes
+pickle its classes and functions.
+"""
+
+import ast
+import os
+import sys
+import types
+
+GAME_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         "2048 game.py")
+MODULE_NAME = "twenty_forty_eight"
+GUI_MODULES = ("poc_2048_gui",)
+
+
+def load_game(path=GAME_FILE):
+    """
+    Return the game logic module, loading it on first use
+    """
+    if MODULE_NAME in sys.modules:
+        return sys.modules[MODULE_NAME]
+    source_file = open(path)
+    try:
+        tree = ast.parse(source_file.read(), path)
+    finally:
+        source_file.close()
+    body = []
+    for node in tree.body:
+        if isinstance(node, ast.Import) and [alias for alias in node.names
+                                             if alias.name in GUI_MODULES]:
+            continue
+        body.append(node)
+    tree.body = body
+    module = types.ModuleType(MODULE_NAME)
+    module.__file__ = path
+    sys.modules[MODULE_NAME] = module
+    exec(compile(tree, path, "exec"), module.__dict__)
+    return module
@@ -0,0 +1,267 @@
+"""
+Serve many concurrent games of 2048 over TCP with asyncio.
+
+All games live in one SessionManager, which packs the tiles of every
+session into a single bytearray. Clients send one request per line
+and get one line back:
+
+    NEW                          OK <session>
+    MOVE <session> <direction>   OK <moved 0/1> <score gained> <score>
+    GRID <session>               OK <tile values in row-major order>
+    CLOSE <session>              OK
+
+where direction is up, down, left or right. Requests from every
+connection go through one bounded queue served by a single task that
+owns the session manager, so game state needs no locks. When the queue
+is full, connections wait before reading more requests.
+
+Example:
+    python session_server_2048.py --port 2048 --capacity 100000
+"""
+
+import argparse
+import asyncio
+import random
+
+import headless_2048
+
+game_logic = headless_2048.load_game()
+
+DIRECTIONS = {"up": game_logic.UP, "down": game_logic.DOWN,
+              "left": game_logic.LEFT, "right": game_logic.RIGHT}
+
+
+class SessionManager:
+    """
+    Host many games of the same size in one preallocated bytearray
+    holding one tile exponent per byte, a row of grid_height *
+    grid_width bytes per session. All sessions share the line
+    tables of get_line_indices from the game logic.
+    """
+
+    def __init__(self, capacity, grid_height=4, grid_width=4, rng=random):
+        self._height = grid_height
+        self._width = grid_width
+        self._size = grid_height * grid_width
+        self._lines = game_logic.get_line_indices(grid_height, grid_width)
+        self._rng = rng
+        self._cells = bytearray(capacity * self._size)
+        self._scores = [0] * capacity
+        self._in_use = [False] * capacity
+        # free session slots, popped from the end
+        self._free = list(range(capacity - 1, -1, -1))
+
+    def get_capacity(self):
+        """
+        Return the number of sessions the manager can hold.
+        """
+        return len(self._scores)
+
+    def get_active_count(self):
+        """
+        Return the number of open sessions.
+        """
+        return len(self._scores) - len(self._free)
+
+    def open_session(self):
+        """
+        Start a new game with two tiles and return its session
+        number, or None when all sessions are in use.
+        """
+        if not self._free:
+            return None
+        session = self._free.pop()
+        base = session * self._size
+        self._cells[base:base + self._size] = bytearray(self._size)
+        self._scores[session] = 0
+        self._in_use[session] = True
+        self._new_tile(session)
+        self._new_tile(session)
+        return session
+
+    def close_session(self, session):
+        """
+        End the game of the given session and free its slot.
+        """
+        self._check_open(session)
+        self._in_use[session] = False
+        self._free.append(session)
+
+    def get_score(self, session):
+        """
+        Return the score of the given session.
+        """
+        return self._scores[session]
+
+    def get_grid(self, session):
+        """
+        Return the grid of the given session as a list of rows.
+        """
+        self._check_open(session)
+        base = session * self._size
+        return [[game_logic.TILE_VALUES[exponent] if exponent <= game_logic.MAX_EXPONENT
+                 else 2 ** exponent
+                 for exponent in self._cells[base + row * self._width:
+                                             base + (row + 1) * self._width]]
+                for row in range(self._height)]
+
+    def move(self, session, direction):
+        """
+        Move all tiles of the given session in the given direction,
+        adding a new tile if any tiles moved. Return whether the
+        grid changed and the score gained.
+        """
+        self._check_open(session)
+        cells = self._cells
+        base = session * self._size
+        moved = False
+        score = 0
+        for line in self._lines[direction]:
+            exponents = [cells[base + idx] for idx in line]
+            result, line_score = game_logic.merge_exponents(exponents)
+            if result != exponents:
+                moved = True
+                score += line_score
+                for idx in range(len(line)):
+                    cells[base + line[idx]] = result[idx]
+        if moved:
+            self._scores[session] += score
+            self._new_tile(session)
+        return moved, score
+
+    def _check_open(self, session):
+        """
+        Raise ValueError unless the given session is open
+        """
+        if not self._in_use[session]:
+            raise ValueError("session %d is not open" % session)
+
+    def _new_tile(self, session):
+        """
+        Add a 2 (90% of the time) or a 4 in a random empty square
+        of the given session.
+        """
+        base = session * self._size
+        empty = [idx for idx in range(base, base + self._size)
+                 if self._cells[idx] == 0]
+        if empty:
+            probable_exponent = [1, 1, 1, 1, 1, 1, 1, 1, 1, 2]
+            self._cells[self._rng.choice(empty)] = self._rng.choice(
+                probable_exponent)
+
+
+class MoveServer:
+    """
+    Asyncio front end queueing requests for a SessionManager
+    """
+
+    def __init__(self, manager, queue_size=1024):
+        self._manager = manager
+        self._queue = asyncio.Queue(queue_size)
+
+    async def submit(self, words):
+        """
+        Queue a request given as a list of words and return the
+        response line once it is handled
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((words, future))
+        return await future
+
+    async def serve_requests(self):
+        """
+        Handle queued requests one at a time, forever
+        """
+        while True:
+            words, future = await self._queue.get()
+            try:
+                response = self.handle(words)
+            except (ValueError, IndexError, KeyError) as error:
+                response = "ERROR " + str(error)
+            if not future.cancelled():
+                future.set_result(response)
+
+    def handle(self, words):
+        """
+        Return the response line to a request
+        """
+        command = words[0].upper()
+        if command == "NEW":
+            session = self._manager.open_session()
+            if session is None:
+                return "ERROR no free session"
+            return "OK %d" % session
+        session = int(words[1])
+        if not 0 <= session < self._manager.get_capacity():
+            raise ValueError("unknown session %d" % session)
+        if command == "MOVE":
+            moved, score = self._manager.move(session,
+                                              DIRECTIONS[words[2].lower()])
+            return "OK %d %d %d" % (moved, score,
+                                    self._manager.get_score(session))
+        elif command == "GRID":
+            grid = self._manager.get_grid(session)
+            return "OK " + " ".join([str(value) for row in grid
+                                     for value in row])
+        elif command == "CLOSE":
+            self._manager.close_session(session)
+            return "OK"
+        raise ValueError("unknown command " + command)
+
+    async def handle_connection(self, reader, writer):
+        """
+        Answer the requests of one client until it disconnects
+        """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                words = line.decode("ascii", "replace").split()
+                if not words:
+                    continue
+                response = await self.submit(words)
+                # errors echo the request, which may hold the
+                # replacement characters of undecodable bytes
+                writer.write(response.encode("ascii", "replace") + b"\n")
+                await writer.drain()
+        finally:
+            writer.close()
+
+
+async def serve(host, port, capacity, height, width, queue_size):
+    """
+    Run the server until it is cancelled
+    """
+    manager = SessionManager(capacity, height, width)
+    server = MoveServer(manager, queue_size)
+    worker = asyncio.ensure_future(server.serve_requests())
+    listener = await asyncio.start_server(server.handle_connection,
+                                          host, port)
+    try:
+        await listener.serve_forever()
+    finally:
+        worker.cancel()
+
+
+def main():
+    """
+    Start the server from the command line
+    """
+    parser = argparse.ArgumentParser(
+        description="Serve 2048 sessions over TCP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2048)
+    parser.add_argument("--capacity", type=int, default=100000,
+                        help="maximum number of live sessions")
+    parser.add_argument("--height", type=int, default=4)
+    parser.add_argument("--width", type=int, default=4)
+    parser.add_argument("--queue-size", type=int, default=1024,
+                        help="requests waiting before clients are paused")
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, args.capacity, args.height,
+                      args.width, args.queue_size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+Play many full games of 2048 with an AI policy across a pool of
+worker processes and report how the policy did.
+
+Every game gets its own seed derived from the base seed and the game
+number, so results do not depend on the number of workers or the order
+in which games finish. Each finished game is written as one JSON line
+to the output file as soon as it is received.
+
+Example:
+    python tournament_2048.py --games 10000 --policy expectimax \\
+        --time-budget 20 --output results.jsonl
+"""
+
+import argparse
+import json
+import multiprocessing
+import random
+import time
+
+import headless_2048
+
+game_logic = headless_2048.load_game()
+
+POLICIES = ("random", "expectimax", "montecarlo")
+PERCENTILES = (10, 50, 90, 99)
+SEED_STRIDE = 1000003
+
+
+def game_seed(base_seed, game_number):
+    """
+    Return the seed of the given game of the tournament
+    """
+    return base_seed * SEED_STRIDE + game_number
+
+
+def make_policy(name, time_budget, seed):
+    """
+    Return a function choosing the next direction for a game,
+    or None when the game is over
+    """
+    policy_rng = random.Random(seed)
+    if name == "expectimax":
+        player = game_logic.ExpectimaxPlayer(time_budget=time_budget)
+        return player.choose_move
+    elif name == "montecarlo":
+        player = game_logic.MonteCarloPlayer(time_budget=time_budget,
+                                             rng=policy_rng)
+        return player.choose_move
+
+    def random_policy(game):
+        """
+        Move in a random legal direction
+        """
+        legal = game.legal_moves()
+        if not legal:
+            return None
+        return policy_rng.choice(legal)
+    return random_policy
+
+
+def play_game(task):
+    """
+    Play the game described by the task tuple (game number, seed,
+    policy name, time budget, height, width) to the end and return
+    its result dictionary
+    """
+    game_number, seed, policy_name, time_budget, height, width = task
+    start = time.time()
+    game = game_logic.create_game(height, width, rng=random.Random(seed))
+    game.new_tile()
+    game.new_tile()
+    policy = make_policy(policy_name, time_budget, seed + 1)
+    moves = 0
+    direction = policy(game)
+    while direction is not None:
+        game.move(direction)
+        moves += 1
+        direction = policy(game)
+    return {"game": game_number, "seed": seed, "score": game.get_score(),
+            "max_tile": game.get_max_tile(), "moves": moves,
+            "wall_time": time.time() - start}
+
+
+def percentile(values, percent):
+    """
+    Return the nearest-rank percentile of a list of values
+    """
+    ordered = sorted(values)
+    rank = int(round(percent / 100.0 * (len(ordered) - 1)))
+    return ordered[rank]
+
+
+def summarize(results):
+    """
+    Return a dictionary with the percentiles of the score, max tile,
+    move count and wall time over the given game results
+    """
+    summary = {"games": len(results)}
+    if not results:
+        return summary
+    for key in ("score", "max_tile", "moves", "wall_time"):
+        values = [result[key] for result in results]
+        summary[key] = dict([("p%d" % percent, percentile(values, percent))
+                             for percent in PERCENTILES])
+    return summary
+
+
+def run_tournament(num_games, policy_name="random", time_budget=20,
+                   height=4, width=4, base_seed=0, workers=None,
+                   output=None):
+    """
+    Play num_games games on a pool of worker processes (one per core
+    by default), writing each result as a JSON line to the open file
+    output as it arrives. Return the list of results.
+    """
+    tasks = [(game_number, game_seed(base_seed, game_number), policy_name,
+              time_budget, height, width)
+             for game_number in range(num_games)]
+    results = []
+    # build the bitboard tables once per worker, outside the game timings
+    pool = multiprocessing.Pool(workers, game_logic.build_row_tables)
+    try:
+        for result in pool.imap_unordered(play_game, tasks):
+            results.append(result)
+            if output is not None:
+                output.write(json.dumps(result, sort_keys=True) + "\n")
+                output.flush()
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+
+def print_summary(summary, elapsed):
+    """
+    Print the tournament summary
+    """
+    print("%d games in %.1f s (%.1f games/s)"
+          % (summary["games"], elapsed, summary["games"] / max(elapsed, 1e-9)))
+    for key in ("score", "max_tile", "moves", "wall_time"):
+        if key in summary:
+            print("%-10s %s" % (key, "  ".join(
+                ["p%d=%s" % (percent, summary[key]["p%d" % percent])
+                 for percent in PERCENTILES])))
+
+
+def main():
+    """
+    Run a tournament from the command line
+    """
+    parser = argparse.ArgumentParser(
+        description="Play 2048 games with an AI policy on worker processes")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--policy", choices=POLICIES, default="random")
+    parser.add_argument("--time-budget", type=int, default=20,
+                        help="milliseconds per move for search policies")
+    parser.add_argument("--height", type=int, default=4)
+    parser.add_argument("--width", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes, one per core by default")
+    parser.add_argument("--output", default=None,
+                        help="JSONL file receiving one line per game")
+    args = parser.parse_args()
+
+    output = None
+    if args.output:
+        output = open(args.output, "w")
+    start = time.time()
+    try:
+        results = run_tournament(args.games, args.policy, args.time_budget,
+                                 args.height, args.width, args.seed,
+                                 args.workers, output)
+    finally:
+        if output is not None:
+            output.close()
+    print_summary(summarize(results), time.time() - start)
+
+
+if __name__ == "__main__":
+    main()
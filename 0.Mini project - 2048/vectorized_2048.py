@@ -0,0 +1,222 @@
+"""
+NumPy kernels stepping and evaluating whole batches of 2048 boards
+at once.
+
+Boards are (N, H, W) integer arrays of tile values, 0 for an empty
+square. Each direction is turned into a move to the left by
+transposing and flipping the batch as its OFFSETS entry says and
+turned back after the move. Lines of 4 tiles below 32768 are moved
+by indexing arrays of the row tables of the bitboard engine with
+their packed rows; the tables saturate at 32768, so a merge of two
+32768 tiles would be wrong. Other lines are compacted, merged and
+compacted again with array operations over all lines. Python only
+loops over the squares of one line, never over boards. evaluate_arrays scores
+a batch with the features and weights of a HeuristicEvaluator.
+
+Example:
+    import numpy
+    import vectorized_2048
+    boards = numpy.zeros((1000000, 4, 4), dtype=numpy.int64)
+    moved, changed, scores = vectorized_2048.move_arrays(boards, 3)
+"""
+
+import numpy
+
+import headless_2048
+
+game_logic = headless_2048.load_game()
+
+# Array copies of the row tables, keyed by name, filled on first use
+ROW_ARRAYS = {}
+
+
+def row_arrays():
+    """
+    Return the dictionary of the row tables as arrays: "left" and
+    "score" for moves to the left and "values" with the 4 tile
+    values of every packed row
+    """
+    if "left" not in ROW_ARRAYS:
+        game_logic.build_row_tables()
+        rows = numpy.arange(game_logic.ROW_MASK + 1)
+        exponents = (rows[:, None] >> (4 * numpy.arange(
+            game_logic.BITBOARD_SIZE))) & 0xF
+        ROW_ARRAYS["left"] = numpy.array(game_logic.ROW_LEFT)
+        ROW_ARRAYS["score"] = numpy.array(game_logic.ROW_LEFT_SCORE)
+        ROW_ARRAYS["values"] = numpy.where(exponents > 0, 1 << exponents, 0)
+    return ROW_ARRAYS
+
+
+def orient(boards, direction):
+    """
+    Return a view of the batch in which moving in the given
+    direction is a move to the left. Lines step along the row axis
+    when the OFFSETS entry of the direction steps through rows, and
+    start from the far edge when it steps backwards.
+    """
+    row_step, col_step = game_logic.OFFSETS[direction]
+    if row_step != 0:
+        boards = boards.transpose(0, 2, 1)
+    if row_step < 0 or col_step < 0:
+        boards = boards[:, :, ::-1]
+    return boards
+
+
+def unorient(boards, direction):
+    """
+    Return the batch oriented back from orient
+    """
+    row_step, col_step = game_logic.OFFSETS[direction]
+    if row_step < 0 or col_step < 0:
+        boards = boards[:, :, ::-1]
+    if row_step != 0:
+        boards = boards.transpose(0, 2, 1)
+    return boards
+
+
+def compact(lines):
+    """
+    Return the (M, L) array of lines with their tiles moved to the
+    start, in order
+    """
+    filled = lines != 0
+    positions = numpy.cumsum(filled, axis=1) - 1
+    result = numpy.zeros_like(lines)
+    line_numbers = numpy.nonzero(filled)[0]
+    result[line_numbers, positions[filled]] = lines[filled]
+    return result
+
+
+def merge_arrays(lines):
+    """
+    Slide and merge an (M, L) array of lines towards their start.
+    Return the merged lines and the score of each line.
+    """
+    if (lines.shape[1] == game_logic.BITBOARD_SIZE
+            and lines.max(initial=0) < game_logic.TILE_VALUES[-1]):
+        return merge_rows(lines)
+    lines = compact(lines)
+    scores = numpy.zeros(len(lines), dtype=lines.dtype)
+    for col in range(lines.shape[1] - 1):
+        merging = (lines[:, col] != 0) & (lines[:, col] == lines[:, col + 1])
+        lines[merging, col] *= 2
+        lines[merging, col + 1] = 0
+        scores += numpy.where(merging, lines[:, col], 0)
+    return compact(lines), scores
+
+
+def tile_exponents(boards):
+    """
+    Return the array of the base 2 exponents of an array of tile
+    values, 0 for an empty square
+    """
+    # frexp writes a tile 2 ** e as 0.5 * 2 ** (e + 1) and an empty
+    # square as 0 * 2 ** 0
+    return numpy.maximum(numpy.frexp(boards)[1] - 1, 0).astype(numpy.int64)
+
+
+def pack_rows(exponents):
+    """
+    Return the (M,) array of the packed rows of an (M, 4) array of
+    exponents up to 15
+    """
+    rows = exponents[:, 0]
+    for col in range(1, game_logic.BITBOARD_SIZE):
+        rows = rows | (exponents[:, col] << (4 * col))
+    return rows
+
+
+def merge_rows(lines):
+    """
+    Return the merged lines and scores of an (M, 4) array of lines
+    of tiles below 32768, looked up in the row tables
+    """
+    tables = row_arrays()
+    rows = pack_rows(tile_exponents(lines))
+    merged = tables["values"][tables["left"][rows]].astype(lines.dtype)
+    return merged, tables["score"][rows].astype(lines.dtype)
+
+
+def move_arrays(boards, direction):
+    """
+    Move every board of an (N, H, W) integer array in the given
+    direction without adding new tiles. Return the (N, H, W) array
+    of moved boards, the (N,) boolean array telling whether each
+    board changed and the (N,) array of scores gained by the merges.
+    """
+    boards = numpy.asarray(boards)
+    oriented = orient(boards, direction)
+    count, num_lines, length = oriented.shape
+    lines, line_scores = merge_arrays(oriented.reshape(count * num_lines,
+                                                       length))
+    moved = numpy.ascontiguousarray(
+        unorient(lines.reshape(count, num_lines, length), direction))
+    changed = (moved != boards).reshape(count, num_lines * length).any(axis=1)
+    scores = line_scores.reshape(count, num_lines).sum(axis=1)
+    return moved, changed, scores
+
+
+def row_feature_array():
+    """
+    Return the (65536, 4) array of the line features of every
+    packed row
+    """
+    if "features" not in ROW_ARRAYS:
+        game_logic.build_feature_tables()
+        ROW_ARRAYS["features"] = numpy.array(game_logic.ROW_FEATURES)
+    return ROW_ARRAYS["features"]
+
+
+def line_feature_totals(lines):
+    """
+    Return the features of line_features summed over the lines of
+    each board of an (N, lines, L) array of tile exponents, as a
+    list of (N,) arrays in the order of LINE_FEATURES
+    """
+    count, num_lines, length = lines.shape
+    steps = numpy.diff(lines, axis=2)
+    rise = numpy.maximum(steps, 0).sum(axis=2)
+    fall = numpy.maximum(-steps, 0).sum(axis=2)
+    monotonicity = -numpy.minimum(rise, fall).sum(axis=1)
+    tiles = compact(lines.reshape(count * num_lines, length))
+    neighbours = (tiles[:, :-1] != 0) & (tiles[:, 1:] != 0)
+    differences = numpy.abs(numpy.diff(tiles, axis=1))
+    smoothness = -(differences * neighbours).sum(axis=1)
+    merges = ((differences == 0) & neighbours).sum(axis=1)
+    empty = (lines == 0).sum(axis=(1, 2))
+    return [monotonicity, smoothness.reshape(count, num_lines).sum(axis=1),
+            empty, merges.reshape(count, num_lines).sum(axis=1)]
+
+
+def evaluate_arrays(boards, evaluator=None):
+    """
+    Return the (N,) array of the values the HeuristicEvaluator (a
+    default one if None) gives the boards of an (N, H, W) integer
+    array of tile values.
+    """
+    if evaluator is None:
+        evaluator = game_logic.HeuristicEvaluator()
+    weights = evaluator.get_weights()
+    # every square is in one row and one column
+    line_weights = numpy.array([weights[name] for name in
+                                game_logic.LINE_FEATURES])
+    line_weights[game_logic.LINE_FEATURES.index("empty")] /= 2.0
+    boards = numpy.asarray(boards)
+    exponents = tile_exponents(boards)
+    values = numpy.full(len(boards), weights["base"])
+    size = game_logic.BITBOARD_SIZE
+    if (boards.shape[1:] == (size, size)
+            and exponents.max(initial=0) <= game_logic.MAX_EXPONENT):
+        row_values = row_feature_array().dot(line_weights)
+        for lines in (exponents, exponents.transpose(0, 2, 1)):
+            rows = pack_rows(lines.reshape(len(boards) * size, size))
+            values += row_values[rows].reshape(len(boards), size).sum(axis=1)
+    else:
+        for lines in (exponents, exponents.transpose(0, 2, 1)):
+            values += numpy.array(line_feature_totals(lines)).T.dot(
+                line_weights)
+    largest = exponents.max(axis=(1, 2))
+    corners = numpy.stack([exponents[:, 0, 0], exponents[:, 0, -1],
+                           exponents[:, -1, 0], exponents[:, -1, -1]], axis=1)
+    in_corner = (largest > 0) & (corners == largest[:, None]).any(axis=1)
+    return values + weights["corner"] * numpy.where(in_corner, largest, 0)
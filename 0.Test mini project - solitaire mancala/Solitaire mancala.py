@@ -2,6 +2,106 @@
 Implementation of SolitaireMancala class for the game
 of the same name
 """
+
+# First move of a win from each solved tuple of houses (house 1
+# first, trailing empty houses dropped), 0 for the won board and
+# None for boards that cannot be won. Shared by all games.
+WINNING_MOVES = {(): 0}
+
+def strip_houses(houses):
+    """
+    Return the seeds of the houses as a tuple without the
+    empty houses at the end
+    """
+    end = len(houses)
+    while end > 0 and houses[end - 1] == 0:
+        end -= 1
+    return tuple(houses[:end])
+
+def sow_houses(houses, house_num):
+    """
+    Return the tuple of houses after moving the seeds of
+    house house_num, which must be a legal move
+    """
+    board = list(houses)
+    for idx in range(house_num - 1):
+        board[idx] += 1
+    board[house_num - 1] = 0
+    return strip_houses(board)
+
+def legal_houses(houses):
+    """
+    Return the legal moves on a tuple of houses, largest first
+    """
+    return [house_num for house_num in range(len(houses), 0, -1)
+            if houses[house_num - 1] == house_num]
+
+def solve_houses(houses):
+    """
+    Return the list of moves winning the game from the given
+    houses, or None if no sequence of moves wins. Every move
+    puts exactly one seed in the store, so all wins have as
+    many moves as there are seeds in the houses.
+    """
+    start = strip_houses(houses)
+    if start not in WINNING_MOVES:
+        #depth first search without recursion, each entry of the
+        #stack holding a board, its moves still to try and the
+        #move being tried
+        stack = [[start, legal_houses(start), 0]]
+        while stack:
+            entry = stack[-1]
+            if not entry[1]:
+                WINNING_MOVES[entry[0]] = None
+                stack.pop()
+                continue
+            entry[2] = entry[1].pop()
+            child = sow_houses(entry[0], entry[2])
+            if child not in WINNING_MOVES:
+                stack.append([child, legal_houses(child), 0])
+            elif WINNING_MOVES[child] is not None:
+                #every board on the stack wins through its last move
+                for board, dummy_moves, move in stack:
+                    WINNING_MOVES[board] = move
+                stack = []
+    if WINNING_MOVES[start] is None:
+        return None
+    moves = []
+    board = start
+    while board:
+        moves.append(WINNING_MOVES[board])
+        board = sow_houses(board, moves[-1])
+    return moves
+
+def winnable_boards(max_seeds=None):
+    """
+    Generate the winnable board with k seeds in its houses for k
+    from 1 to max_seeds (without end if max_seeds is None), as a
+    (configuration, moves) pair: the configuration for set_board,
+    store first and empty, and the moves winning it. There is one
+    such board for each k. It is built from the board with k - 1
+    seeds by undoing a move into the first empty house i: house i
+    gets its i seeds back and each house below it gives one up.
+    """
+    houses = []
+    #moves from the last one played to the first
+    moves = []
+    seeds = 0
+    while max_seeds is None or seeds < max_seeds:
+        house_num = 1
+        while house_num <= len(houses) and houses[house_num - 1] != 0:
+            house_num += 1
+        if house_num > len(houses):
+            houses.append(0)
+        for idx in range(house_num - 1):
+            houses[idx] -= 1
+        houses[house_num - 1] = house_num
+        moves.append(house_num)
+        seeds += 1
+        winning_moves = list(moves)
+        winning_moves.reverse()
+        yield [0] + houses, winning_moves
+
 class SolitaireMancala:
     """
     Class that implements Solitaire Mancala
@@ -13,6 +113,8 @@ class SolitaireMancala:
         and no houses
         """
         self._board = [0]
+        #legal moves in decreasing order, smallest last
+        self._legal = []
         
     def set_board(self, configuration):
         """
@@ -23,6 +125,8 @@ class SolitaireMancala:
         left in ascending order
         """
         self._board = list(configuration)
+        self._legal = [idx for idx in range(len(self._board) - 1, 0, -1)
+                       if self._board[idx] == idx]
         
     def __str__(self):
         """
@@ -57,18 +161,48 @@ class SolitaireMancala:
             return False
         
     def apply_move(self, house_num):
-        """ Apply a legal move for house house_num to the board."""
+        """ Apply a legal move for house house_num to the board.
+        Only houses up to house_num change, so only legal moves
+        up to house_num are updated."""
         if self.is_legal_move(house_num):
+            #the houses below gain a seed, so none of them stays legal
+            while self._legal and self._legal[-1] <= house_num:
+                self._legal.pop()
             for idx in range(house_num):
                 self._board[idx] += 1
             self._board[house_num] = 0
+            for idx in range(house_num - 1, 0, -1):
+                if self._board[idx] == idx:
+                    self._legal.append(idx)
+
+    def undo_move(self, house_num):
+        """ Undo the move for house house_num that apply_move last
+        applied, putting its seeds back in place. Nothing happens
+        unless the house is empty and every house below it, store
+        included, holds a seed."""
+        if not (1 <= house_num and house_num < len(self._board)):
+            return
+        if self._board[house_num] != 0:
+            return
+        for idx in range(house_num):
+            if self._board[idx] == 0:
+                return
+        #the houses below lose a seed, so none of them stays legal
+        while self._legal and self._legal[-1] < house_num:
+            self._legal.pop()
+        for idx in range(house_num):
+            self._board[idx] -= 1
+        self._board[house_num] = house_num
+        self._legal.append(house_num)
+        for idx in range(house_num - 1, 0, -1):
+            if self._board[idx] == idx:
+                self._legal.append(idx)
         
     def choose_move(self):
         """ Return the index for the legal move whose house is
         closest to the store. If no legal move is available, return 0."""
-        for idx in range(1, len(self._board)):
-            if self.is_legal_move(idx):
-                return idx
+        if self._legal:
+            return self._legal[-1]
         return 0
     
     def is_game_won(self):
@@ -98,6 +232,18 @@ class SolitaireMancala:
             legal_moves.append(next_move)
             next_move = game.choose_move()
         return legal_moves
+
+    def solve_moves(self):
+        """Return a shortest list of legal moves winning the game,
+        trying every order of moves rather than only the one
+        choose_move picks, or None if the game cannot be won.
+        Solved boards are remembered across games."""
+        return solve_houses(self._board[1:])
+
+    def is_winnable(self):
+        """Return True if some sequence of legal moves wins the
+        game. Return False otherwise."""
+        return self.solve_moves() is not None
   
 #import test suite and run
 #import poc_mancala_testsuite
@@ -0,0 +1,205 @@
+"""
+Benchmark the Solitaire Mancala implementations against each other
+and write the results as JSON.
+
+Each implementation runs set_board, choose_move, is_game_won and
+plan_moves on the same boards of 10 to 10,000 houses, built from fixed
+seeds, and must give the same answers as the first one. Time per call
+is reported for every method, and with tracemalloc (Python 3) the peak
+memory allocated by one call.
+
+Example:
+    python benchmark_mancala.py --output bench.json
+"""
+
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import headless_mancala
+
+mancala = headless_mancala.load_mancala()
+
+timer = getattr(time, "perf_counter", time.time)
+
+VARIANTS = (("student", headless_mancala.MANCALA_FILE),
+            ("instructor", headless_mancala.INSTRUCTOR_FILE))
+SIZES = (10, 100, 1000, 10000)
+METHODS = ("set_board", "choose_move", "is_game_won", "plan_moves")
+
+
+def load_variants(variants=VARIANTS):
+    """
+    Return the list of (name, SolitaireMancala class) of the given
+    (name, path) implementations
+    """
+    return [(name, headless_mancala.load_mancala(
+                 path, "solitaire_mancala_" + name).SolitaireMancala)
+            for name, path in variants]
+
+
+def winnable_houses(num_seeds):
+    """
+    Return the houses of the winnable board with num_seeds seeds
+    """
+    configuration = None
+    for configuration, dummy_moves in mancala.winnable_boards(num_seeds):
+        pass
+    return configuration[1:]
+
+
+def build_corpus(seed, sizes=SIZES):
+    """
+    Return the list of (name, configuration) boards: for each size,
+    a board with random seeds in each house (0 to its number), a
+    winnable board of that many seeds and the same board below
+    random houses that can never be moved
+    """
+    rng = random.Random(seed)
+    corpus = []
+    for size in sizes:
+        houses = [rng.randint(0, house) for house in range(1, size + 1)]
+        corpus.append(("random_%d" % size, [0] + houses))
+        houses = winnable_houses(size)
+        corpus.append(("winnable_%d" % len(houses), [0] + houses))
+        for house in range(len(houses) + 1, size + 1):
+            houses.append(rng.randint(0, house - 1))
+        corpus.append(("blocked_%d" % size, [0] + houses))
+    return corpus
+
+
+def run_method(game_class, method, configuration):
+    """
+    Call the method on a game set to the configuration and return
+    its answer, made comparable between implementations
+    """
+    game = game_class()
+    if method == "set_board":
+        game.set_board(configuration)
+        return str(game)
+    game.set_board(configuration)
+    if method == "choose_move":
+        return game.choose_move()
+    elif method == "is_game_won":
+        return game.is_game_won()
+    moves = game.plan_moves()
+    for move in moves:
+        game.apply_move(move)
+    return moves, game.is_game_won(), str(game)
+
+
+def call_method(games, method, configuration):
+    """
+    Call the method once on each game
+    """
+    for game in games:
+        if method == "set_board":
+            game.set_board(configuration)
+        elif method == "choose_move":
+            game.choose_move()
+        elif method == "is_game_won":
+            game.is_game_won()
+        else:
+            game.plan_moves()
+
+
+def measure(game_class, method, configuration, repeat):
+    """
+    Return the seconds per call of the method on the configuration,
+    timing only the method calls, and the peak bytes allocated by
+    one call (None without tracemalloc), traced apart from the timing
+    """
+    games = []
+    for dummy in range(repeat + 1):
+        game = game_class()
+        if method != "set_board":
+            game.set_board(configuration)
+        games.append(game)
+    start = timer()
+    call_method(games[1:], method, configuration)
+    elapsed = timer() - start
+    peak = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        call_method(games[:1], method, configuration)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return elapsed / repeat, peak
+
+
+def run_benchmarks(seed=0, scale=1.0, variants=VARIANTS):
+    """
+    Check that every implementation agrees on the corpus, then time
+    each method. Return the list of result records; raise ValueError
+    naming the first disagreement.
+    """
+    classes = load_variants(variants)
+    corpus = build_corpus(seed)
+    for board_name, configuration in corpus:
+        for method in METHODS:
+            expected = run_method(classes[0][1], method, configuration)
+            for name, game_class in classes[1:]:
+                if run_method(game_class, method, configuration) != expected:
+                    raise ValueError("%s and %s disagree on %s for %s"
+                                     % (classes[0][0], name, method,
+                                        board_name))
+    results = []
+    for board_name, configuration in corpus:
+        # fewer calls on large boards
+        repeat = max(1, int(scale * 20000 / len(configuration)))
+        for method in METHODS:
+            for name, game_class in classes:
+                seconds, peak = measure(game_class, method, configuration,
+                                        repeat)
+                results.append({"board": board_name, "method": method,
+                                "variant": name,
+                                "houses": len(configuration) - 1,
+                                "calls": repeat, "seconds": seconds,
+                                "peak_bytes": peak})
+    return results
+
+
+def main():
+    """
+    Run the benchmarks from the command line
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark the Solitaire Mancala implementations")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="multiplier for the number of calls")
+    parser.add_argument("--output", default=None,
+                        help="JSON file receiving the results")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.seed, args.scale)
+    for record in results:
+        peak = record["peak_bytes"]
+        if peak is None:
+            peak = "-"
+        print("%-15s %-12s %-10s %12.1f us %10s B" % (
+            record["board"], record["method"], record["variant"],
+            record["seconds"] * 1e6, peak))
+    if args.output:
+        report = {"python": sys.version.split()[0],
+                  "platform": platform.platform(),
+                  "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                  "seed": args.seed, "scale": args.scale,
+                  "results": results}
+        output = open(args.output, "w")
+        try:
+            json.dump(report, output, indent=2, sort_keys=True)
+        finally:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Load a Solitaire Mancala implementation outside CodeSkulptor.
+
+The implementations import the CodeSkulptor test suite and GUI
+modules, which only exist in the browser, and run them at the end of
+the file. They are loaded with those imports and calls left out and
+registered as regular modules, which lets worker processes pickle
+their classes and functions.
+"""
+
+import ast
+import os
+import sys
+import types
+
+MANCALA_DIR = os.path.dirname(os.path.abspath(__file__))
+MANCALA_FILE = os.path.join(MANCALA_DIR, "Solitaire mancala.py")
+INSTRUCTOR_FILE = os.path.join(MANCALA_DIR,
+                               "Solitaire manacal (instructor's implementation).py")
+MODULE_NAME = "solitaire_mancala"
+BROWSER_PREFIX = "poc_"
+
+
+def uses_browser_module(node):
+    """
+    Return True if the statement imports a browser-only module or
+    calls a function of one
+    """
+    if isinstance(node, ast.Import):
+        return bool([alias for alias in node.names
+                     if alias.name.startswith(BROWSER_PREFIX)])
+    if isinstance(node, ast.Expr) and isinstance(node.value, ast.Call):
+        func = node.value.func
+        return (isinstance(func, ast.Attribute)
+                and isinstance(func.value, ast.Name)
+                and func.value.id.startswith(BROWSER_PREFIX))
+    return False
+
+
+def load_mancala(path=MANCALA_FILE, module_name=MODULE_NAME):
+    """
+    Return the module of the implementation in the given file,
+    loading it on first use
+    """
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    source_file = open(path)
+    try:
+        tree = ast.parse(source_file.read(), path)
+    finally:
+        source_file.close()
+    tree.body = [node for node in tree.body if not uses_browser_module(node)]
+    module = types.ModuleType(module_name)
+    module.__file__ = path
+    sys.modules[module_name] = module
+    exec(compile(tree, path, "exec"), module.__dict__)
+    return module
@@ -0,0 +1,176 @@
+"""
+Label every Solitaire Mancala board with up to N houses as winnable
+or not by the greedy plan_moves rule, across a pool of worker
+processes, and write the labels to disk as a bitmap.
+
+House i can only be emptied while it holds at most i seeds, so the
+boards analyzed are those where house i holds 0 to i seeds. Boards
+with fewer houses are the ones whose last houses are empty. The rank
+of a board is the sum over its houses of seeds(i) * i!, a number from
+0 to (N + 1)! - 1; bit rank % 8 of byte rank // 8 of the output is
+set when that board is winnable.
+
+A move takes i seeds out of house i and adds one to each lower house,
+so the board it leads to has a lower rank. Boards are labelled in
+rank order, each copying the label of the board its greedy move
+leads to. Work is split into chunks of boards that only differ in
+their lowest houses; moves out of those houses stay in the chunk.
+Boards whose first greedy move is out of a higher house are run
+through plan_moves.
+
+Example:
+    python winnability_mancala.py --houses 9 --output winnable.bin
+"""
+
+import argparse
+import multiprocessing
+import time
+
+import headless_mancala
+
+mancala = headless_mancala.load_mancala()
+
+CHUNK_HOUSES = 7
+
+
+def house_weights(num_houses):
+    """
+    Return the list of the rank weights i! of houses 0 to num_houses
+    """
+    weights = [1]
+    for house in range(1, num_houses + 1):
+        weights.append(weights[-1] * house)
+    return weights
+
+
+def count_boards(num_houses):
+    """
+    Return the number of boards with num_houses houses analyzed
+    """
+    return house_weights(num_houses + 1)[-1]
+
+
+def board_rank(configuration):
+    """
+    Return the rank of a board given as a configuration of
+    set_board, the store first
+    """
+    weights = house_weights(len(configuration) - 1)
+    rank = 0
+    for house in range(1, len(configuration)):
+        rank += configuration[house] * weights[house]
+    return rank
+
+
+def is_winnable(bitmap, configuration):
+    """
+    Return True if the bitmap labels the board given as a
+    configuration of set_board as winnable
+    """
+    rank = board_rank(configuration)
+    return bool(bitmap[rank >> 3] & (1 << (rank & 7)))
+
+
+def analyze_chunk(task):
+    """
+    Label the boards of the chunk described by the task tuple
+    (houses, chunk houses, chunk number) and return their bitmap.
+    Boards of a chunk share the seeds of the houses above the
+    lowest chunk houses.
+    """
+    num_houses, chunk_houses, chunk = task
+    weights = house_weights(num_houses)
+    size = weights[chunk_houses] * (chunk_houses + 1)
+    # rank of the board a greedy move out of a chunk house leads to,
+    # relative to the rank of the board it starts from
+    rank_changes = [0]
+    for house in range(1, chunk_houses + 1):
+        rank_changes.append(sum(weights[1:house]) - house * weights[house])
+    board = [0] * (num_houses + 1)
+    rest = chunk
+    for house in range(chunk_houses + 1, num_houses + 1):
+        rest, board[house] = divmod(rest, house + 1)
+    high_moves = [house for house in range(chunk_houses + 1, num_houses + 1)
+                  if board[house] == house]
+    game = mancala.SolitaireMancala()
+    labels = bytearray(size)
+    for rank in range(size):
+        if rank:
+            house = 1
+            while board[house] == house:
+                board[house] = 0
+                house += 1
+            board[house] += 1
+        for house in range(1, chunk_houses + 1):
+            if board[house] == house:
+                labels[rank] = labels[rank + rank_changes[house]]
+                break
+        else:
+            if high_moves:
+                # every move puts one seed in the store, so the plan
+                # wins when it has a move per seed
+                game.set_board(board)
+                labels[rank] = len(game.plan_moves()) == sum(board)
+            else:
+                labels[rank] = rank == 0 and chunk == 0
+    bitmap = bytearray((size + 7) // 8)
+    for rank in range(size):
+        if labels[rank]:
+            bitmap[rank >> 3] |= 1 << (rank & 7)
+    return bytes(bitmap)
+
+
+def analyze(num_houses, output, chunk_houses=CHUNK_HOUSES, workers=None):
+    """
+    Label every board with num_houses houses on a pool of worker
+    processes (one per core by default), writing the bitmap to the
+    open binary file output chunk by chunk. Return the number of
+    winnable boards.
+    """
+    chunk_houses = max(1, min(chunk_houses, num_houses))
+    if num_houses > chunk_houses and chunk_houses < 3:
+        # chunks must fill whole bytes, which needs at least 4! boards
+        chunk_houses = min(3, num_houses)
+    num_chunks = count_boards(num_houses) // count_boards(chunk_houses)
+    tasks = [(num_houses, chunk_houses, chunk) for chunk in range(num_chunks)]
+    winnable = 0
+    pool = multiprocessing.Pool(workers)
+    try:
+        for bitmap in pool.imap(analyze_chunk, tasks):
+            output.write(bitmap)
+            winnable += sum([bin(byte).count("1")
+                             for byte in bytearray(bitmap) if byte])
+    finally:
+        pool.close()
+        pool.join()
+    return winnable
+
+
+def main():
+    """
+    Run the analysis from the command line
+    """
+    parser = argparse.ArgumentParser(
+        description="Label Solitaire Mancala boards as winnable or not")
+    parser.add_argument("--houses", type=int, default=8)
+    parser.add_argument("--output", default="winnable.bin",
+                        help="file receiving the bitmap of the labels")
+    parser.add_argument("--chunk-houses", type=int, default=CHUNK_HOUSES,
+                        help="houses varied within one chunk of work")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes, one per core by default")
+    args = parser.parse_args()
+
+    start = time.time()
+    output = open(args.output, "wb")
+    try:
+        winnable = analyze(args.houses, output, args.chunk_houses,
+                           args.workers)
+    finally:
+        output.close()
+    print("%d of %d boards winnable in %.1f s"
+          % (winnable, count_boards(args.houses), time.time() - start))
+
+
+if __name__ == "__main__":
+    main()